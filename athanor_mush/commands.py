@@ -3,14 +3,19 @@ import MySQLdb.cursors as cursors
 import datetime
 import pytz
 import random
+import time
+
+from itertools import groupby
 
 from django.conf import settings
 from evennia import GLOBAL_SCRIPTS
-from django.db.models import Q
+from django.db.models import Q, Max
 
 from . convpenn import PennParser, process_penntext
-from . models import MushObject, cobj, pmatch, objmatch, MushAttributeName, MushAttribute
-from athanor.utils.text import penn_substitutions
+from . models import MushObject, cobj, pmatch, objmatch, object_resolver
+from . loader import PennObjectLoader, ImportJournal, import_session
+from . progress import ImportProgress
+from . search import AttributeSearch
 from athanor.core.command import AthanorCommand
 
 
@@ -22,96 +27,140 @@ def from_mushtimestring(timestring):
     return convert
 
 
+class SQLStream(object):
+    """
+    The rows of a legacy MySQL query, read through an unbuffered server-side cursor chunk_size rows at a time so the
+    table is never held in client memory. len() runs a separate COUNT(*). A connection can only read one stream at a
+    time, and iterating again re-runs the query.
+    """
+
+    def __init__(self, connection, query, chunk_size=1000):
+        self.connection = connection
+        self.query = query
+        self.chunk_size = chunk_size
+        self.count = None
+
+    def __len__(self):
+        if self.count is None:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(f"SELECT COUNT(*) AS total FROM ({self.query}) AS counted")
+                self.count = cursor.fetchone()['total']
+            finally:
+                cursor.close()
+        return self.count
+
+    def __iter__(self):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(self.query)
+            while (rows := cursor.fetchmany(self.chunk_size)):
+                yield from rows
+        finally:
+            cursor.close()
+
+
 class CmdPennImport(AthanorCommand):
     key = '@penn'
     system_name = 'IMPORT'
     locks = 'cmd:perm(Developers)'
-    admin_switches = ['initialize', 'areas', 'grid', 'accounts', 'groups', 'bbs', 'themes', 'radio', 'jobs', 'scenes']
+    admin_switches = ['initialize', 'areas', 'grid', 'accounts', 'groups', 'bbs', 'themes', 'radio', 'jobs', 'scenes',
+                      'reset', 'grep', 'verbose']
+    # Switches that modify whichever stage is being run instead of naming one. They are removed from self.switches
+    # before dispatch, so they never need a switch_ method of their own.
+    modifier_switches = ['verbose']
+    modifiers = frozenset()
     
     def report_status(self, message):
         print(message)
         # self.sys_msg(message)
     
-    def sql_cursor(self):
-        if hasattr(self, 'cursor'):
-            return self.cursor
+    def sql_connection(self):
+        if hasattr(self, 'sql'):
+            return self.sql
         sql_dict = settings.PENNMUSH_SQL_DICT
         self.sql = MySQLdb.connect(host=sql_dict['site'], user=sql_dict['username'],
-                             passwd=sql_dict['password'], db=sql_dict['database'], cursorclass=cursors.DictCursor)
-        self.cursor = self.sql.cursor()
-        return self.cursor
+                             passwd=sql_dict['password'], db=sql_dict['database'], cursorclass=cursors.SSDictCursor)
+        return self.sql
+
+    def sql_rows(self, query):
+        return SQLStream(self.sql_connection(), query,
+                         chunk_size=getattr(settings, 'PENNMUSH_IMPORT_BATCH_SIZE', 1000))
+
+    @property
+    def verbose(self):
+        return 'verbose' in self.modifiers or getattr(settings, 'PENNMUSH_IMPORT_VERBOSE', False)
+
+    def progress(self, stage, total=None):
+        return ImportProgress(stage, total=total, callback=self.report_status, verbose=self.verbose,
+                              interval=getattr(settings, 'PENNMUSH_IMPORT_REPORT_INTERVAL', 5.0))
+
+    def journal(self, stage, batch_size=None):
+        return ImportJournal(stage, callback=self.report_status,
+                             batch_size=batch_size or getattr(settings, 'PENNMUSH_IMPORT_BATCH_SIZE', 1000))
+
+    def parse(self):
+        # at_pre_cmd runs before parse, so this is the earliest point at which self.switches is known.
+        super().parse()
+        self.modifiers = {switch for switch in self.switches if switch in self.modifier_switches}
+        self.switches = [switch for switch in self.switches if switch not in self.modifier_switches]
+
+    def func(self):
+        # Every stage after initialize resolves dbrefs and objids row by row, so load them all up front.
+        if not set(self.switches) & {'initialize', 'reset', 'grep'}:
+            object_resolver.warm()
+        # The session is shared by the whole process, so a batch rolled back in an earlier run may have left ghosts
+        # and EntityMaps in it that no longer exist. Each run starts from an empty one.
+        import_session.clear()
+        return super().func()
 
     def at_post_cmd(self):
         if hasattr(self, 'sql'):
             self.sql.close()
 
     def switch_initialize(self):
+        parser = PennParser(callback=self.report_status, workers=getattr(settings, 'PENNMUSH_PARSE_WORKERS', 1),
+                            snapshot=getattr(settings, 'PENNMUSH_PARSE_SNAPSHOT', True), verbose=self.verbose)
+        outdb = self.args.strip() if self.args else 'outdb'
         try:
-            mush_import = PennParser('outdb', self.report_status)
+            penn_objects = parser.iter_objects(outdb)
         except IOError as err:
             self.error(str(err))
-            self.error("Had an IOError. Did you put the outdb in the game's root directory?")
+            self.error("Had an IOError. Did you put the outdb in the game's root directory, or give its path?")
             return
         except ValueError as err:
             self.error(str(err))
             return
 
-        penn_objects = mush_import.mush_data
-
-        obj_dict = dict()
-
-        dbrefs = sorted(penn_objects.keys(), key=lambda dbr: int(dbr.strip('#')))
-        db_count = len(dbrefs)
-        for count, entity in enumerate(dbrefs, start=1):
-            penn_data = penn_objects[entity]
-            self.report_status(f"Processing MushObject {count} of {db_count} - {penn_data['objid']}: {penn_data['name']}")
-            entry, created = MushObject.objects.get_or_create(dbref=entity, objid=penn_data['objid'],
-                                                              type=penn_data['type'], name=penn_data['name'],
-                                                              flags=penn_data['flags'], powers=penn_data['powers'],
-                                                              created=from_unixtimestring(penn_data['created']))
-            if created:
-                entry.save()
-
-            obj_dict[entity] = entry
+        loader = PennObjectLoader(callback=self.report_status,
+                                  batch_size=getattr(settings, 'PENNMUSH_IMPORT_BATCH_SIZE', 1000))
+        try:
+            db_count, attr_count = loader.load(penn_objects)
+        except ValueError as err:
+            self.error(str(err))
+            return
 
-        def set_attr(penn_data, entry, attr, target):
-            try:
-                if penn_data[attr] in obj_dict:
-                    setattr(entry, target, obj_dict[penn_data[attr]])
-            except Exception as e:
-                self.report_status(f"ERROR DETECTED ON {penn_data}: {entry}, {attr} -> {target}")
-                raise e
-
-        for counter, entity in enumerate(dbrefs, start=1):
-            penn_data = penn_objects[entity]
-            entry = obj_dict[entity]
-            self.report_status(f"Performing Secondary Processing on MushObject {counter} of {db_count} - {entry.objid}: {entry.name}")
-            for attr, target in (('parent', 'parent'), ('owner', 'owner')):
-                set_attr(penn_data, entry, attr, target)
-
-            if penn_data['type'] == 4:  # For exits!
-                for attr, target in (('location', 'destination'), ('exits', 'location')):
-                    set_attr(penn_data, entry, attr, target)
-            else:
-                set_attr(penn_data, entry, 'location', 'location')
-            entry.save()
+        if AttributeSearch().build():
+            self.report_status("Built the full-text index of MushAttribute values.")
+        else:
+            self.report_status("This database has no full-text support. @penn/grep will scan MushAttributes instead.")
 
-            attr_dict = dict()
+        self.report_status(f"Imported {db_count} MushObjects and {attr_count} MushAttributes into Django. Ready for additional operations.")
 
-            for attr, value in penn_data['attributes'].items():
-                attr_upper = attr.upper()
-                if attr_upper in attr_dict:
-                    attr_name = attr_dict[attr_upper]
-                else:
-                    attr_name, created = MushAttributeName.objects.get_or_create(key=attr_upper)
-                    if created:
-                        attr_name.save()
-                    attr_dict[attr_upper] = attr_name
-                attr_entry, created2 = entry.attrs.get_or_create(attr=attr_name, value=penn_substitutions(value))
-                if not created2:
-                    attr_entry.save()
+    def switch_grep(self):
+        if not self.args:
+            self.error("What text should be searched for?")
+            return
+        results = AttributeSearch().search(self.args.strip())
+        if not results:
+            self.msg(f"No MushAttributes mention '{self.args.strip()}'.")
+            return
+        message = [f"{objid} {name}/{key}: {snippet}" for objid, name, key, snippet in results]
+        self.msg('\n'.join(message))
 
-        self.report_status(f"Imported {db_count} MushObjects and {MushAttribute.objects.count()} MushAttributes into Django. Ready for additional operations.")
+    def switch_reset(self):
+        count = ImportJournal.reset(self.args)
+        self.msg(f"Cleared {count} import checkpoints. Those stages will start over from the beginning.")
 
     def switch_area_recursive(self, district, parent=None):
         area = district.area
@@ -130,25 +179,37 @@ class CmdPennImport(AthanorCommand):
         self.report_status("All done with Areas!")
 
     def switch_grid(self):
+        """
+        Rooms and exits are loaded together with their parents, areas and linked objects, and their descriptions
+        and aliases are read for the whole grid at once, so the number of queries does not grow with its size.
+        """
         area_con = GLOBAL_SCRIPTS.area
-        mush_rooms = MushObject.objects.filter(type=1, obj=None).exclude(Q(parent=None) | Q(parent__area=None))
+        rooms_query = MushObject.objects.filter(type=1, obj=None).exclude(Q(parent=None) | Q(parent__area=None))
+        descriptions = MushObject.objects.attr_map(rooms_query, ['DESCRIBE'])
+        mush_rooms = list(rooms_query.select_related('parent__area__db_object'))
 
         mush_rooms_count = len(mush_rooms)
+        progress = self.progress('Rooms', mush_rooms_count)
 
         for counter, mush_room in enumerate(mush_rooms, start=1):
-            self.report_status(f"Processing Room {counter} of {mush_rooms_count} - {mush_room.objid}: {mush_room.name}")
+            progress.detail(f"Processing Room {counter} of {mush_rooms_count} - {mush_room.objid}: {mush_room.name}")
             new_room = area_con.create_room(self.session, mush_room.parent.area.db_object, mush_room.name, self.account)
             mush_room.obj = new_room
-            mush_room.obj.db.desc = process_penntext(mush_room.mushget('DESCRIBE'))
+            mush_room.obj.db.desc = process_penntext(descriptions[mush_room.id]['DESCRIBE'])
             mush_room.save()
+            progress.update()
+        progress.finish()
 
-        mush_exits = MushObject.objects.filter(type=4, obj=None).exclude(Q(location__parent__area=None) | Q(destination__parent__area=None) | Q(location__obj=None) | Q(destination__obj=None))
+        exits_query = MushObject.objects.filter(type=4, obj=None).exclude(Q(location__parent__area=None) | Q(destination__parent__area=None) | Q(location__obj=None) | Q(destination__obj=None))
+        aliases_map = MushObject.objects.attr_map(exits_query, ['ALIAS'])
+        mush_exits = list(exits_query.select_related('location__parent__area__db_object', 'location__obj', 'destination__obj'))
         mush_exits_count = len(mush_exits)
+        progress = self.progress('Exits', mush_exits_count)
 
         for counter, mush_exit in enumerate(mush_exits, start=1):
-            self.report_status(f"Processing Exit {counter} of {mush_exits_count} - {mush_exit.objid}: {mush_exit.name} FROM {mush_exit.location.name} TO {mush_exit.destination.name}")
+            progress.detail(f"Processing Exit {counter} of {mush_exits_count} - {mush_exit.objid}: {mush_exit.name} FROM {mush_exit.location.name} TO {mush_exit.destination.name}")
             aliases = None
-            alias_text = mush_exit.mushget('alias')
+            alias_text = aliases_map[mush_exit.id]['ALIAS']
             if alias_text:
                 aliases = alias_text.split(';')
 
@@ -157,6 +218,8 @@ class CmdPennImport(AthanorCommand):
                                                   aliases=aliases)
             mush_exit.obj = new_exit
             mush_exit.save()
+            progress.update()
+        progress.finish()
 
     def random_password(self):
         password = "ABCDEFGHabcdefgh@+-" + str(random.randrange(5000000, 1000000000))
@@ -166,26 +229,10 @@ class CmdPennImport(AthanorCommand):
         return password
 
     def ghost_account(self, objid, name, email):
-        par = cobj(abbr='accounts')
-        if (found := par.children.filter(objid=objid).first()):
-            return found
-        dbref, created = objid.split(':')
-        ghost, created = par.children.get_or_create(dbref=dbref, objid=objid, created=from_unixtimestring(created),
-                                                    location=par, name=name, owner=par, type=par.type, recreated=True)
-        if created:
-            ghost.save()
-        return ghost
+        return import_session.account(objid, name, email)
 
     def ghost_character(self, objid, name):
-        character = pmatch(objid)
-        if character:
-            return character
-        dbref, timestamp = objid.split(':',1)
-        ghost, created = MushObject.objects.get_or_create(dbref=dbref, objid=objid, name=name, created=from_unixtimestring(timestamp), recreated=True,
-                           type=8)
-        if created:
-            ghost.save()
-        return ghost
+        return import_session.character(objid, name)
 
     def get_lost_and_found(self):
         try:
@@ -199,17 +246,18 @@ class CmdPennImport(AthanorCommand):
     def switch_accounts(self):
         accounts_con = GLOBAL_SCRIPTS.accounts
 
-        c = self.sql_cursor()
-
-        c.execute("""SELECT * FROM volv_accounts ORDER BY account_date_created ASC""")
-        mush_accounts = c.fetchall()
+        mush_accounts = self.sql_rows("""SELECT * FROM volv_accounts ORDER BY account_date_created ASC, account_id ASC""")
 
         mush_accounts_obj = {obj.objid: obj for obj in cobj(abbr='accounts').children.filter()}
         mush_accounts_count = len(mush_accounts)
 
-        mush_account_dict = dict()
+        journal = self.journal('accounts')
+        mush_account_dict = journal.mapping(key=int)
 
-        for counter, mush_acc in enumerate(mush_accounts, start=1):
+        progress = self.progress('Accounts', mush_accounts_count)
+
+        def import_account(row):
+            counter, mush_acc = row
             objid = mush_acc['account_objid']
             old_name = mush_acc['account_name']
             old_email = mush_acc['account_email']
@@ -217,18 +265,21 @@ class CmdPennImport(AthanorCommand):
                 obj = self.ghost_account(objid, old_name, old_email)
                 mush_accounts_obj[objid] = obj
             if obj.account is not None:
-                continue
+                return
             password = self.random_password()
             username = f"mush_acc_{mush_acc['account_id']}"
             email = f"{username}@ourgame.org"
-            self.report_status(f"Processing Account {counter} of {mush_accounts_count} - {mush_acc.objid}: {mush_acc.name} / {old_email}. New username: {username} - Password: {password}")
+            self.report_status(f"Processing Account {counter} of {mush_accounts_count} - {objid}: {old_name} / {old_email}. New username: {username} - Password: {password}")
             new_account = accounts_con.create_account(self.session, username, email, password)
             obj.account = new_account
             obj.save()
             new_account.db._penn_import = True
-            new_account.db._penn_name = mush_acc.name
+            new_account.db._penn_name = old_name
             new_account.db._penn_email = old_email
             mush_account_dict[mush_acc['account_id']] = new_account
+            return new_account
+
+        journal.run(enumerate(mush_accounts, start=1), lambda row: row[1]['account_id'], import_account, progress=progress)
         self.report_status(f"Imported {mush_accounts_count} PennMUSH Accounts!")
 
         lost_and_found = self.get_lost_and_found()
@@ -236,71 +287,84 @@ class CmdPennImport(AthanorCommand):
 
         chars_con = GLOBAL_SCRIPTS.characters
 
-        c.execute("""SELECT * FROM volv_character""")
-        mush_characters = c.fetchall()
+        mush_characters = self.sql_rows("""SELECT * FROM volv_character ORDER BY character_objid ASC""")
 
-        mush_characters_obj = MushObject.objects.filter(type=8, obj=None).exclude(powers__icontains='Guest')
+        characters_query = MushObject.objects.filter(type=8).exclude(powers__icontains='Guest')
+        mush_characters_obj = {obj.objid: obj for obj in characters_query.select_related('parent__account')}
         mush_characters_count = len(mush_characters)
+        # Everything the import reads from the characters' attributes, fetched up front in two queries.
+        character_attrs = MushObject.objects.attr_map(characters_query, ['DESCRIBE', 'LASTLOGOUT', 'V`ADMIN'])
+        character_aliases = MushObject.objects.attr_map(characters_query, ['ALIAS'], check_parent=False)
 
-        for counter, mush_char in enumerate(mush_characters, start=1):
-            self.report_status(f"Processing Character {counter} of {mush_characters_count} - {mush_char.objid}: {mush_char.name}")
+        progress = self.progress('Characters', mush_characters_count)
 
+        def import_character(row):
+            counter, mush_char = row
             objid = mush_char['character_objid']
             old_name = mush_char['character_name']
+            progress.detail(f"Processing Character {counter} of {mush_characters_count} - {objid}: {old_name}")
 
             if not (obj := mush_characters_obj.get(objid, None)):
                 obj = self.ghost_character(objid, old_name)
                 mush_characters_obj[objid] = obj
 
             if obj.obj is not None:
-                continue
+                return
 
             acc_id = mush_char['account_id']
             if not (acc := mush_account_dict.get(acc_id, None)):
-                if mush_char.parent and mush_char.parent.account:
-                    acc = mush_char.parent.account
-                    self.report_status(f"Account Found! Will assign to Account: {acc}")
+                if obj.parent and obj.parent.account:
+                    acc = obj.parent.account
+                    progress.detail(f"Account Found! Will assign to Account: {acc}")
                 else:
                     acc = lost_and_found
-                    self.report_status("Character has no Account! Will assign to Lost and Found!")
+                    progress.detail("Character has no Account! Will assign to Lost and Found!")
             else:
-                self.report_status(f"Account Found! Will assign to Account: {acc}")
+                progress.detail(f"Account Found! Will assign to Account: {acc}")
             namespace = None if obj.recreated else 0
             new_char = chars_con.create_character(self.session, acc, obj.name, namespace=namespace)
             obj.obj = new_char
             obj.save()
+            # From now on this objid resolves to the new character rather than its MushObject.
+            import_session.forget(objid)
             new_char.db._penn_import = True
 
-            for alias in obj.aliases():
+            # Characters made by ghost_character() have no attributes of their own.
+            attrs = character_attrs.get(obj.id, {'DESCRIBE': '', 'LASTLOGOUT': '', 'V`ADMIN': ''})
+            alias_text = character_aliases.get(obj.id, {'ALIAS': ''})['ALIAS']
+            for alias in (alias_text.split(';') if alias_text else []):
                 new_char.aliases.add(alias)
-            description = process_penntext(obj.mushget('DESCRIBE'))
+            description = process_penntext(attrs['DESCRIBE'])
             if description:
-                self.report_status(f"FOUND DESCRIPTION: {description}")
+                progress.detail(f"FOUND DESCRIPTION: {description}")
                 new_char.db.desc = description
-            last_logout = obj.mushget('LASTLOGOUT')
+            last_logout = attrs['LASTLOGOUT']
             if last_logout:
                 new_char.db._last_logout = from_mushtimestring(last_logout)
 
-            flags = mush_char.flags.split(' ')
+            flags = obj.flags.split(' ')
 
             if acc != lost_and_found:
                 set_super = obj.dbref == '#1'
                 set_developer = 'WIZARD' in flags
-                set_admin = 'ROYALTY' in flags or int(obj.mushget('V`ADMIN', default='0'))
+                set_admin = 'ROYALTY' in flags or int(attrs['V`ADMIN'] or '0')
                 if set_super:
                     acc.is_superuser = True
                     acc.save()
                     set_developer = False
                     set_admin = False
-                    self.report_status(f"Detected #1 GOD. {acc} and {new_char} has been granted Superuser privileges.")
+                    progress.detail(f"Detected #1 GOD. {acc} and {new_char} has been granted Superuser privileges.")
                 if set_developer:
                     acc.permissions.add('Developer')
                     set_admin = False
-                    self.report_status(f"Detected WIZARD flag. {acc} and {new_char} has been granted Developer privileges.")
+                    progress.detail(f"Detected WIZARD flag. {acc} and {new_char} has been granted Developer privileges.")
                 if set_admin:
                     acc.permissions.add('Admin')
-                    self.report_status(f"Detected ROYALTY flag or Admin Group Membership. {acc} and {new_char} has been granted Admin privileges.")
+                    progress.detail(f"Detected ROYALTY flag or Admin Group Membership. {acc} and {new_char} has been granted Admin privileges.")
 
+        self.journal('accounts_characters').run(enumerate(mush_characters, start=1),
+                                                lambda row: row[1]['character_objid'], import_character,
+                                                progress=progress)
         self.report_status(f"Finished importing {mush_characters_count} characters!")
 
     def switch_info(self):
@@ -310,20 +374,23 @@ class CmdPennImport(AthanorCommand):
         faction_con = GLOBAL_SCRIPTS.faction
         faction_typeclass = faction_con.ndb.faction_typeclass
 
-        c = self.sql_cursor()
+        mush_groups = self.sql_rows("""SELECT * FROM volv_group ORDER BY group_parent ASC, group_id ASC""")
 
-        c.execute("""SELECT * FROM volv_group ORDER BY group_parent ASC""")
-        mush_groups = c.fetchall()
+        journal = self.journal('groups')
         faction_map = {None: None}
+        faction_map.update(journal.mapping(key=int))
 
         mush_groups_count = len(mush_groups)
 
-        for counter, mush_group in enumerate(mush_groups, start=1):
-            self.report_status(f"Processing MushGroup {counter} of {mush_groups_count} - {mush_group}")
+        progress = self.progress('Groups', mush_groups_count)
+
+        def import_group(row):
+            counter, mush_group = row
+            progress.detail(f"Processing MushGroup {counter} of {mush_groups_count} - {mush_group}")
 
             mush_object = objmatch(mush_group['group_objid'])
             if not mush_object:
-                continue
+                return
 
             abbr = mush_group['group_abbr'] if mush_group['group_abbr'] else None
             new_faction = faction_typeclass.create_faction(name=mush_group['group_name'],
@@ -334,17 +401,24 @@ class CmdPennImport(AthanorCommand):
             faction_map[mush_group['group_id']] = new_faction
             mush_object.group = new_faction
             mush_object.save()
+            return new_faction
+
+        journal.run(enumerate(mush_groups, start=1), lambda row: row[1]['group_id'], import_group, progress=progress)
 
-        c.execute("""SELECT * FROM volv_group_rank""")
-        mush_groups_ranks = c.fetchall()
-        role_map = dict()
+        mush_groups_ranks = self.sql_rows("""SELECT * FROM volv_group_rank ORDER BY group_rank_id ASC""")
+
+        journal = self.journal('groups_ranks')
+        role_map = journal.mapping(key=int)
 
         mush_groups_ranks_count = len(mush_groups_ranks)
 
-        for counter, mush_group_rank in enumerate(mush_groups_ranks, start=1):
+        progress = self.progress('Group Ranks', mush_groups_ranks_count)
+
+        def import_rank(row):
+            counter, mush_group_rank = row
             if mush_group_rank['group_id'] not in faction_map:
-                continue
-            self.report_status(f"Processing MushGroupRank {counter} of {mush_groups_ranks_count} - {mush_group_rank}")
+                return
+            progress.detail(f"Processing MushGroupRank {counter} of {mush_groups_ranks_count} - {mush_group_rank}")
             faction = faction_map[mush_group_rank['group_id']]
             role_typeclass = faction.get_role_typeclass()
             rank_name = process_penntext(mush_group_rank['group_rank_title'])
@@ -355,25 +429,31 @@ class CmdPennImport(AthanorCommand):
             if created:
                 new_role.save()
             role_map[mush_group_rank['group_rank_id']] = new_role
+            return new_role
 
-        c.execute("""SELECT * FROM volv_group_member""")
-        mush_groups_members = c.fetchall()
+        journal.run(enumerate(mush_groups_ranks, start=1), lambda row: row[1]['group_rank_id'], import_rank, progress=progress)
+
+        mush_groups_members = self.sql_rows("""SELECT * FROM volv_group_member ORDER BY group_id ASC, character_objid ASC""")
 
         mush_groups_members_count = len(mush_groups_members)
 
-        for counter, mush_group_member in enumerate(mush_groups_members, start=1):
+        progress = self.progress('Group Members', mush_groups_members_count)
+
+        def import_member(row):
+            counter, mush_group_member = row
             if mush_group_member['group_id'] not in faction_map:
-                continue
-            self.report_status(f"Processing MushGroupMembership {counter} of {mush_groups_members_count} - {mush_group_member}")
+                return
+            progress.detail(f"Processing MushGroupMembership {counter} of {mush_groups_members_count} - {mush_group_member}")
             character = pmatch(mush_group_member['character_objid'])
             if not character:
-                continue
+                return
             faction = faction_map[mush_group_member['group_id']]
             link_typeclass = faction.get_link_typeclass()
             role = role_map[mush_group_member['group_rank_id']]
             super_user = role.sort_order < 3
             group_title = process_penntext(mush_group_member['group_member_title']) if mush_group_member['group_member_title'] else None
-            new_link = link_typeclass(db_entity=character.entity, db_faction=faction, db_member=True,
+            new_link = link_typeclass(db_entity=import_session.entity(mush_group_member['character_objid']),
+                                      db_faction=faction, db_member=True,
                                       db_is_superuser=super_user, db_key=character.key)
             new_link.save()
             new_link.db.title = group_title
@@ -381,63 +461,103 @@ class CmdPennImport(AthanorCommand):
             new_role_link = role_link_typeclass(db_link=new_link, db_role=role, db_grantable=False, db_key=role.key)
             new_role_link.save()
 
+        self.journal('groups_members').run(enumerate(mush_groups_members, start=1),
+                                          lambda row: f"{row[1]['group_id']}:{row[1]['character_objid']}",
+                                          import_member, progress=progress)
+
         from athanor.characters.characters import AthanorPlayerCharacter
-        for counter, character in enumerate(AthanorPlayerCharacter.objects.filter_family()):
-            if not hasattr(character, 'mush'):
-                continue
-            tiers = character.mush.mushget('V`TIERS')
-            if not tiers:
-                continue
-            tiers = tiers.split(' ')[0]
-            group = objmatch(tiers)
+        characters_query = MushObject.objects.filter(obj__in=AthanorPlayerCharacter.objects.filter_family())
+        tiers_map = MushObject.objects.attr_map(characters_query, ['V`TIERS'])
+        group_ids = {obj_id: object_resolver.object_id(attrs['V`TIERS'].split(' ')[0])
+                     for obj_id, attrs in tiers_map.items() if attrs['V`TIERS']}
+        groups = MushObject.objects.select_related('group').in_bulk({obj_id for obj_id in group_ids.values() if obj_id})
+        for mush_character in characters_query.filter(id__in=list(group_ids)).select_related('obj'):
+            group = groups.get(group_ids[mush_character.id])
             if not group:
                 continue
-            character.db._primary_faction = group.group
+            mush_character.obj.db._primary_faction = group.group
 
     def switch_bbs(self):
         forum_con = GLOBAL_SCRIPTS.forum
         category_typeclass = forum_con.ndb.category_typeclass
         board_typeclass = forum_con.ndb.board_typeclass
         thread_typeclass = forum_con.ndb.thread_typeclass
-        c = self.sql_cursor()
+        post_typeclass = forum_con.ndb.post_typeclass
 
-        c.execute("""SELECT * FROM volv_board ORDER BY group_id ASC,board_number DESC""")
-        mush_boards = c.fetchall()
-        forum_category_map = dict()
-        forum_board_map = dict()
+        mush_boards = self.sql_rows("""SELECT * FROM volv_board ORDER BY group_id ASC,board_number DESC,board_id ASC""")
 
         mush_boards_count = len(mush_boards)
 
         factions = {obj.objid: obj.group for obj in MushObject.objects.exclude(group=None) if not obj.group.parent}
         factions[None] = None
 
-        new_category = category_typeclass.create_forum_category(key="Public Boards", abbr='')
-        forum_category_map[None] = new_category
+        category_objids = [None]
+        for mush_board in mush_boards:
+            if mush_board['group_objid'] not in category_objids:
+                category_objids.append(mush_board['group_objid'])
+
+        journal = self.journal('bbs_categories')
+        forum_category_map = journal.mapping(key=lambda objid: objid or None)
+
+        progress = self.progress('Forum Categories', len(category_objids))
 
-        for counter, mush_board in enumerate(mush_boards, start=1):
-            self.report_status(f"Processing MushBoard {counter} of {mush_boards_count} - {mush_board}")
-            faction = factions[mush_board['group_objid']]
-            if faction not in forum_category_map:
+        def import_category(objid):
+            faction = factions[objid]
+            if faction is None:
+                new_category = category_typeclass.create_forum_category(key="Public Boards", abbr='')
+            else:
                 new_category = category_typeclass.create_forum_category(key=faction.key, abbr=faction.abbreviation)
-                new_category.save()
-                forum_category_map[faction] = new_category
-            forum_category = forum_category_map[faction]
+            new_category.save()
+            forum_category_map[objid] = new_category
+            return new_category
+
+        journal.run(category_objids, lambda objid: objid or '', import_category, progress=progress)
+
+        journal = self.journal('bbs_boards')
+        forum_board_map = journal.mapping(key=int)
+
+        progress = self.progress('Boards', mush_boards_count)
+
+        def import_board(row):
+            counter, mush_board = row
+            progress.detail(f"Processing MushBoard {counter} of {mush_boards_count} - {mush_board}")
+            forum_category = forum_category_map[mush_board['group_objid']]
             new_board = board_typeclass.create_forum_board(category=forum_category, key=mush_board['board_name'], order=mush_board['board_number'])
             if mush_board['board_mandatory']:
                 new_board.forum_board_bridge.mandatory = True
             forum_board_map[mush_board['board_id']] = new_board
+            return new_board
+
+        journal.run(enumerate(mush_boards, start=1), lambda row: row[1]['board_id'], import_board, progress=progress)
+
+        # Every poster's ghost and entity is created up front, in bulk, and then served from the import session.
+        posters = self.sql_rows("""SELECT entity_objid, MIN(entity_name) AS entity_name FROM (SELECT entity_objid, entity_name FROM volv_bbpost UNION ALL SELECT entity_objid, entity_name FROM volv_bbcomment) AS posters GROUP BY entity_objid ORDER BY entity_objid ASC""")
+        count = import_session.prepare((row['entity_objid'], row['entity_name']) for row in posters)
+        self.report_status(f"Resolved {count} BBS posters.")
 
-        forum_thread_map = dict()
-        forum_post_map = dict()
+        def poster(objid, name):
+            return import_session.character(objid, name), import_session.entity(objid, name)
 
-        c.execute("""SELECT * FROM volv_bbpost ORDER BY post_display_num ASC""")
-        mush_posts = c.fetchall()
+        mush_posts = self.sql_rows("""SELECT * FROM volv_bbpost ORDER BY post_display_num ASC, post_id ASC""")
+
+        journal = self.journal('bbs_posts')
+        forum_thread_map = journal.mapping(key=int)
 
         mush_posts_count = len(mush_posts)
 
-        for counter, mush_post in enumerate(mush_posts, start=1):
-            self.report_status(f"Processing MushPost {counter} of {mush_posts_count} - {mush_post}")
-            obj = self.ghost_character(mush_post['entity_objid'], mush_post['entity_name'])
+        progress = self.progress('Posts', mush_posts_count)
+
+        # Posts are queued and written with one bulk_create per journal batch.
+        new_posts = list()
+
+        def write_posts():
+            post_typeclass.objects.bulk_create(new_posts)
+            new_posts.clear()
+
+        def import_post(row):
+            counter, mush_post = row
+            progress.detail(f"Processing MushPost {counter} of {mush_posts_count} - {mush_post}")
+            obj, entity = poster(mush_post['entity_objid'], mush_post['entity_name'])
             board = forum_board_map[mush_post['board_id']]
             created = mush_post['post_date_created']
             modified = mush_post['post_date_modified']
@@ -449,61 +569,81 @@ class CmdPennImport(AthanorCommand):
 
             new_thread.save()
             forum_thread_map[mush_post['post_id']] = new_thread
-            new_post = post_typeclass(db_entity=entity, db_date_created=created, db_date_modified=modified,
-                                      db_thread=new_thread, db_order=1, db_key=title,
-                                      db_body=process_penntext(mush_post['post_text']))
-            new_post.save()
+            new_posts.append(post_typeclass(db_entity=entity, db_date_created=created, db_date_modified=modified,
+                                            db_thread=new_thread, db_order=1, db_key=title,
+                                            db_body=process_penntext(mush_post['post_text'])))
+            return new_thread
+
+        journal.run(enumerate(mush_posts, start=1), lambda row: row[1]['post_id'], import_post, progress=progress,
+                    flush=write_posts)
 
-        c.execute("""SELECT * FROM volv_bbcomment ORDER BY comment_display_num ASC""")
-        mush_comments = c.fetchall()
+        mush_comments = self.sql_rows("""SELECT * FROM volv_bbcomment ORDER BY comment_display_num ASC, comment_id ASC""")
 
-        from django.db.models import Max
         mush_comments_count = len(mush_comments)
 
-        for counter, mush_comment in enumerate(mush_comments, start=1):
-            self.report_status(f"Processing MushPostComment {counter} of {mush_comments_count} - {mush_comment}")
-            entity = self.ghost_character(mush_comment['entity_objid'], mush_comment['entity_name']).entity
+        # The last order used in every thread, read once and then counted up in memory.
+        thread_orders = {row['db_thread']: row['max_order'] or 0 for row in
+                         post_typeclass.objects.values('db_thread').annotate(max_order=Max('db_order'))}
+
+        progress = self.progress('Comments', mush_comments_count)
+
+        def import_comment(row):
+            counter, mush_comment = row
+            progress.detail(f"Processing MushPostComment {counter} of {mush_comments_count} - {mush_comment}")
+            obj, entity = poster(mush_comment['entity_objid'], mush_comment['entity_name'])
             thread = forum_thread_map[mush_comment['post_id']]
             created = mush_comment['comment_date_created']
             modified = mush_comment['comment_date_modified']
-            stats = thread.posts.aggregate(Max('db_order'))
-            order = stats['db_order__max'] + 1
-            new_post = post_typeclass(db_entity=entity, db_date_created=created, db_date_modified=modified,
-                                      db_order=order, db_key='Imported MUSH Comment',
-                                      db_body=process_penntext(mush_comment['comment_text']), db_thread=thread)
-            new_post.save()
+            order = thread_orders[thread.pk] = thread_orders.get(thread.pk, 0) + 1
+            new_posts.append(post_typeclass(db_entity=entity, db_date_created=created, db_date_modified=modified,
+                                            db_order=order, db_key='Imported MUSH Comment',
+                                            db_body=process_penntext(mush_comment['comment_text']), db_thread=thread))
+
+        self.journal('bbs_comments').run(enumerate(mush_comments, start=1), lambda row: row[1]['comment_id'],
+                                         import_comment, progress=progress, flush=write_posts)
 
         self.report_status("ALl done importing BBS!")
 
     def switch_themes(self):
         theme_con = GLOBAL_SCRIPTS.theme
-        c = self.sql_cursor()
-        c.execute("""SELECT * FROM volv_theme """)
-        mush_themes = c.fetchall()
-        c.execute("""SELECT * FROM volv_theme_member""")
-        mush_theme_members = c.fetchall()
+        mush_themes = self.sql_rows("""SELECT * FROM volv_theme ORDER BY theme_id ASC""")
+        mush_theme_members = self.sql_rows("""SELECT * FROM volv_theme_member ORDER BY theme_id ASC, character_objid ASC""")
 
-        theme_map = dict()
+        journal = self.journal('themes')
+        theme_map = journal.mapping(key=int)
 
         mush_theme_count = len(mush_themes)
 
-        for counter, mush_theme in enumerate(mush_themes, start=1):
-            self.report_status(f"Processing MushTheme {counter} of {mush_theme_count} - {mush_theme['theme_name']}")
+        progress = self.progress('Themes', mush_theme_count)
+
+        def import_theme(row):
+            counter, mush_theme = row
+            progress.detail(f"Processing MushTheme {counter} of {mush_theme_count} - {mush_theme['theme_name']}")
             theme = theme_con.create_theme(self.session, mush_theme['theme_name'], process_penntext(mush_theme['theme_description']))
             theme_map[mush_theme['theme_id']] = theme
+            return theme
+
+        journal.run(enumerate(mush_themes, start=1), lambda row: row[1]['theme_id'], import_theme, progress=progress)
 
         mush_theme_members_count = len(mush_theme_members)
 
-        for counter, mush_theme_member in enumerate(mush_theme_members, start=1):
-            self.report_status(f"Processing MushThemeMembership {counter} of {mush_theme_members_count} - {mush_theme_member}")
+        progress = self.progress('Theme Members', mush_theme_members_count)
+
+        def import_member(row):
+            counter, mush_theme_member = row
+            progress.detail(f"Processing MushThemeMembership {counter} of {mush_theme_members_count} - {mush_theme_member}")
             character = pmatch(mush_theme_member['character_objid'])
             if not character:
-                continue
+                return
             theme = theme_map[mush_theme_member['theme_id']]
             list_type = mush_theme_member['tmember_type']
             theme.add_character(character, list_type)
             character.db.theme_status = mush_theme_member['character_status']
 
+        self.journal('themes_members').run(enumerate(mush_theme_members, start=1),
+                                          lambda row: f"{row[1]['theme_id']}:{row[1]['character_objid']}",
+                                          import_member, progress=progress)
+
         self.report_status("All done importing Themes!")
 
     def switch_radio(self):
@@ -521,40 +661,61 @@ class CmdPennImport(AthanorCommand):
         source_typeclass = rplog_con.ndb.source_typeclass
         codename_typeclass = rplog_con.ndb.codename_typeclass
         action_typeclass = rplog_con.ndb.action_typeclass
-        c = self.sql_cursor()
 
-        c.execute("""SELECT * FROM volv_plot""")
-        mush_plots = c.fetchall()
-        plots_map = dict()
+        mush_plots = self.sql_rows("""SELECT * FROM volv_plot ORDER BY plot_id ASC""")
+        journal = self.journal('scenes_plots')
+        plots_map = journal.mapping(key=int)
         mush_plots_count = len(mush_plots)
 
-        for counter, mush_plot in enumerate(mush_plots, start=1):
-            self.report_status(f"Processing MushPlot {counter} of {mush_plots_count} - {mush_plot}")
+        progress = self.progress('Plots', mush_plots_count)
+
+        def import_plot(row):
+            counter, mush_plot = row
+            progress.detail(f"Processing MushPlot {counter} of {mush_plots_count} - {mush_plot}")
             new_plot = plot_typeclass(db_key=mush_plot['plot_title'], db_pitch=process_penntext(mush_plot['plot_pitch']),
                                       db_summary=process_penntext(mush_plot['plot_summary']),
                                       db_outcome=process_penntext(mush_plot['plot_outcome']),
                                       db_date_start=mush_plot['plot_date_start'], db_date_end=mush_plot['plot_date_end'])
             new_plot.save()
             plots_map[mush_plot['plot_id']] = new_plot
+            return new_plot
 
-        c.execute("""SELECT * FROM volv_runner""")
-        mush_runners = c.fetchall()
+        journal.run(enumerate(mush_plots, start=1), lambda row: row[1]['plot_id'], import_plot, progress=progress)
+
+        # Every runner's and actor's ghost and entity is created up front, in bulk, and then served from the import
+        # session.
+        actors = self.sql_rows("""SELECT character_objid, MIN(character_name) AS character_name FROM (SELECT character_objid, character_name FROM volv_runner UNION ALL SELECT character_objid, character_name FROM volv_actor) AS actors GROUP BY character_objid ORDER BY character_objid ASC""")
+        count = import_session.prepare((row['character_objid'], row['character_name']) for row in actors)
+        self.report_status(f"Resolved {count} scene runners and actors.")
+        actor = import_session.entity
+
+        mush_runners = self.sql_rows("""SELECT * FROM volv_runner ORDER BY plot_id ASC, character_objid ASC""")
         mush_runners_count = len(mush_runners)
 
-        for counter, mush_runner in enumerate(mush_runners, start=1):
-            self.report_status(f"Processing MushPlotRunners {counter} of {mush_runners_count} - {mush_runner}")
-            entity = self.ghost_character(mush_runner['character_objid'], mush_runner['character_name']).entity
+        progress = self.progress('Plot Runners', mush_runners_count)
+
+        def import_runner(row):
+            counter, mush_runner = row
+            progress.detail(f"Processing MushPlotRunners {counter} of {mush_runners_count} - {mush_runner}")
+            entity = actor(mush_runner['character_objid'], mush_runner['character_name'])
             plot = plots_map[mush_runner['plot_id']]
             new_runner = runner_typeclass(db_plot=plot, db_entity=entity, db_runner_type=mush_runner['runner_type'])
             new_runner.save()
 
-        c.execute("""SELECT * FROM volv_scene""")
-        mush_scenes = c.fetchall()
-        events_map = dict()
+        self.journal('scenes_runners').run(enumerate(mush_runners, start=1),
+                                         lambda row: f"{row[1]['plot_id']}:{row[1]['character_objid']}",
+                                         import_runner, progress=progress)
+
+        mush_scenes = self.sql_rows("""SELECT * FROM volv_scene ORDER BY scene_id ASC""")
+        journal = self.journal('scenes_events')
+        events_map = journal.mapping(key=int)
         mush_scenes_count = len(mush_scenes)
 
-        for counter, mush_scene in enumerate(mush_scenes, start=1):
-            self.report_status(f"Processing MushScene {counter} of {mush_scenes_count} - {mush_scene}")
+        progress = self.progress('Scenes', mush_scenes_count)
+
+        def import_scene(row):
+            counter, mush_scene = row
+            progress.detail(f"Processing MushScene {counter} of {mush_scenes_count} - {mush_scene}")
             pitch = process_penntext(mush_scene['scene_pitch'])
             outcome = process_penntext(mush_scene['scene_outcome'])
             new_event = event_typeclass(db_key=mush_scene['scene_title'], db_pitch=pitch, db_outcome=outcome,
@@ -565,65 +726,90 @@ class CmdPennImport(AthanorCommand):
                                         db_status=mush_scene['scene_status'])
             new_event.save()
             events_map[mush_scene['scene_id']] = new_event
+            return new_event
+
+        journal.run(enumerate(mush_scenes, start=1), lambda row: row[1]['scene_id'], import_scene, progress=progress)
 
-        c.execute("""SELECT * FROM vol_plotlink""")
-        plot_links = c.fetchall()
+        plot_links = self.sql_rows("""SELECT * FROM vol_plotlink ORDER BY plot_id ASC, scene_id ASC""")
         plot_links_count = len(plot_links)
 
-        for counter, plot_link in enumerate(plot_links, start=1):
-            self.report_status(f"Processing MushPlotLink {counter} of {plot_links_count} - {plot_link}")
+        progress = self.progress('Plot Links', plot_links_count)
+
+        def import_plot_link(row):
+            counter, plot_link = row
+            progress.detail(f"Processing MushPlotLink {counter} of {plot_links_count} - {plot_link}")
             plot = plots_map[plot_link['plot_id']]
             event = events_map[plot_link['scene_id']]
             event.plots.add(plot)
 
-        c.execute("""SELECT * FROM vol_action_source""")
-        action_sources = c.fetchall()
+        self.journal('scenes_plot_links').run(enumerate(plot_links, start=1),
+                                       lambda row: f"{row[1]['plot_id']}:{row[1]['scene_id']}", import_plot_link, progress=progress)
+
+        action_sources = self.sql_rows("""SELECT * FROM vol_action_source ORDER BY source_id ASC""")
         action_sources_count = len(action_sources)
-        event_source_map = dict()
+        journal = self.journal('scenes_sources')
+        event_source_map = journal.mapping(key=int)
+
+        progress = self.progress('Action Sources', action_sources_count)
 
-        for counter, action_source in enumerate(action_sources, start=1):
-            self.report_status(f"Processing MushActionSource {counter} of {action_sources_count} - {action_source}")
+        def import_action_source(row):
+            counter, action_source = row
+            progress.detail(f"Processing MushActionSource {counter} of {action_sources_count} - {action_source}")
             event = events_map[action_source['scene_id']]
             new_source, created = source_typeclass.objects.get_or_create(db_key=action_source['source_name'], db_event=event,
                                           db_source_type=action_source['source_type'])
             if created:
                 new_source.save()
             event_source_map[action_source['source_id']] = new_source
+            return new_source
 
-        c.execute("""SELECT * FROM volv_actor""")
-        mush_actors = c.fetchall()
-        participant_map = dict()
+        journal.run(enumerate(action_sources, start=1), lambda row: row[1]['source_id'], import_action_source, progress=progress)
+
+        mush_actors = self.sql_rows("""SELECT * FROM volv_actor ORDER BY actor_id ASC""")
+        journal = self.journal('scenes_actors')
+        participant_map = journal.mapping(key=int)
         mush_actors_count = len(mush_actors)
 
-        for counter, mush_actor in enumerate(mush_actors, start=1):
-            self.report_status(f"Processing MushActor {counter} of {mush_actors_count} - {mush_actor}")
+        progress = self.progress('Actors', mush_actors_count)
+
+        def import_actor(row):
+            counter, mush_actor = row
+            progress.detail(f"Processing MushActor {counter} of {mush_actors_count} - {mush_actor}")
             event = events_map[mush_actor['scene_id']]
-            entity = self.ghost_character(mush_actor['character_objid'], mush_actor['character_name']).entity
+            entity = actor(mush_actor['character_objid'], mush_actor['character_name'])
             new_participant = participant_typeclass(db_key=entity.key, db_event=event, db_entity=entity,
                                                     db_participant_type=mush_actor['actor_type'],
                                                     db_action_count=mush_actor['action_count'])
             new_participant.save()
             participant_map[mush_actor['actor_id']] = new_participant
+            return new_participant
 
+        journal.run(enumerate(mush_actors, start=1), lambda row: row[1]['actor_id'], import_actor, progress=progress)
 
-        c.execute("""SELECT * FROM volv_action ORDER BY scene_id ASC,action_date_created ASC""")
-        mush_actions = c.fetchall()
-        action_map = dict()
+        mush_actions = self.sql_rows("""SELECT * FROM volv_action ORDER BY scene_id ASC,action_date_created ASC,action_id ASC""")
         mush_actions_count = len(mush_actions)
-        cur_scene = None
-        order_counter = 0
-        for counter, mush_action in enumerate(mush_actions, start=1):
-            self.report_status(f"Processing MushAction {counter} of {mush_actions_count} - {mush_action}")
-            scene_id = mush_action['scene_id']
+
+        progress = self.progress('Actions', mush_actions_count)
+
+        def import_scene_actions(scene):
+            scene_id, scene_actions = scene
+            started = time.monotonic()
             event = events_map[scene_id]
-            if scene_id != cur_scene:
-                order_counter = 0
-                cur_scene = scene_id
-            participant = participant_map[mush_action['actor_id']]
-            source = event_source_map[mush_action['source_id']]
-            new_action = action_typeclass(db_event=event, db_participant=participant, db_source=source,
-                                          db_ignore=mush_action['action_is_deleted'], db_sort_order=order_counter,
-                                          db_text=process_penntext(mush_action['action_text']))
-            new_action.save()
+            new_actions = [action_typeclass(db_event=event, db_participant=participant_map[mush_action['actor_id']],
+                                            db_source=event_source_map[mush_action['source_id']],
+                                            db_ignore=mush_action['action_is_deleted'], db_sort_order=order,
+                                            db_text=process_penntext(mush_action['action_text']))
+                           for order, mush_action in enumerate(scene_actions, start=1)]
+            action_typeclass.objects.bulk_create(new_actions)
+            elapsed = time.monotonic() - started
+            rate = len(new_actions) / elapsed if elapsed > 0 else 0.0
+            progress.note(f"last MushScene {scene_id}: {len(new_actions)} MushActions in {elapsed:.2f}s, {rate:.1f} rows/s")
+
+        # Actions are written one scene per transaction, so a scene is never left half imported.
+        scenes = ((scene_id, list(scene_actions)) for scene_id, scene_actions in
+                  groupby(mush_actions, key=lambda mush_action: mush_action['scene_id']))
+        self.journal('scenes_actions', batch_size=1).run(scenes, lambda scene: f"scene:{scene[0]}",
+                                                         import_scene_actions, progress=progress,
+                                                         weight=lambda scene: len(scene[1]))
 
         self.report_status("All done importing Rp Logs!")
@@ -1,128 +1,552 @@
-import codecs, re
+import bz2, gzip, hashlib, lzma, mmap, os, pickle, re, sys
+from array import array
+from collections import deque
+from collections.abc import Mapping
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 
-RE_COLOR_CODES = re.compile(r'(?P<fg>.+?)(?:!(?P<bg>.+?))?')
+from . progress import ImportProgress
 
-RE_PUEBLO_XCH = re.compile(r'(?is)(?P<pre>send \\"(?P<com>.+?)\\)"')
+# A Penn color spec is a run of these tokens. Everything after a ! (or /) applies to the background.
+RE_COLOR_CODES = re.compile(r'(?P<hex>#[0-9a-fA-F]{6})|<(?P<angle>[^>]*)>|\+(?P<name>\w+)|(?P<letter>[a-zA-Z])|(?P<bg>[!/])')
 
-RE_PUEBLO_SEND = re.compile(r'(?is)(?P<pre>a XCH_CMD=\\"(?P<com>.+?)\\)"')
+# Penn ANSI color letters. Lowercase is foreground and uppercase is background. The value is the Evennia letter
+# for the normal intensity color; the lowercase Evennia letter is the bright one.
+ANSI_COLORS = {'x': 'X', 'r': 'R', 'g': 'G', 'y': 'Y', 'b': 'B', 'm': 'M', 'c': 'C', 'w': 'W'}
 
+ANSI_ATTRIBUTES = {'h': '|h', 'u': '|u', 'f': '|^', 'i': '|*', 'n': '|n'}
 
+XTERM_LEVELS = (0, 95, 135, 175, 215, 255)
 
-def mxp(text="", command="", hints=""):
-    if text:
-        return "|lc%s|lt%s|le" % (command, text)
-    else:
-        return "|lc%s|lt%s|le" % (command, command)
 
-def re_color(match):
-    return match.group('text')
-    codes_text = match.group('codes')
-    text = match.group('text')
-    if not len(codes_text):
-        return text
+def xterm_code(number):
+    if number < 16:
+        letter = 'XRGYBMCW'[number % 8]
+        return letter.lower() if number > 7 else letter
+    if number > 231:
+        return '=%s' % chr(ord('a') + round((number - 232) * 25 / 23))
+    number -= 16
+    return '%i%i%i' % (number // 36, (number // 6) % 6, number % 6)
 
-    codes = RE_COLOR_CODES.match(codes_text)
 
-    if '<' in codes.group('fg'):
-        pass
+# Evennia code suffixes for all 256 xterm colors, prefixed with | for foreground or |[ for background.
+XTERM_COLORS = tuple(xterm_code(number) for number in range(256))
 
-def re_pueblo(match):
-    if match.group('command').startswith('send'):
-        find = RE_PUEBLO_XCH(match.group('command'))
-        return mxp(text=match.group('text'), command=find.group('com'))
+COLOR_NAMES = {'black': (0, 0, 0), 'red': (255, 0, 0), 'green': (0, 255, 0), 'yellow': (255, 255, 0),
+               'blue': (0, 0, 255), 'magenta': (255, 0, 255), 'cyan': (0, 255, 255), 'white': (255, 255, 255),
+               'orange': (255, 165, 0), 'purple': (160, 32, 240), 'pink': (255, 192, 203), 'brown': (165, 42, 42),
+               'gray': (190, 190, 190), 'grey': (190, 190, 190)}
 
-    if match.group('command').startswith('a'):
-        find = RE_PUEBLO_SEND(match.group('command'))
-        return mxp(text=match.group('text'), command=find.group('com'))
 
-    return match.group('text')
+def rgb_code(red, green, blue):
+    if red == green == blue and 0 < red < 255:
+        return '=%s' % chr(ord('a') + round(red * 25 / 255))
+    return ''.join(str(min(range(6), key=lambda level: abs(XTERM_LEVELS[level] - value)))
+                   for value in (red, green, blue))
 
 
-def re_newlines(match):
-    return '\n'
+def color_value(hex_code=None, angle=None, name=None):
+    if angle is not None:
+        angle = angle.strip()
+        if angle.startswith('#'):
+            hex_code = angle
+        elif angle.isdigit():
+            number = int(angle)
+            return XTERM_COLORS[number] if number < 256 else None
+        elif angle.replace(' ', '').isdigit():
+            red, green, blue = (min(int(value), 255) for value in angle.split()[:3])
+            return rgb_code(red, green, blue)
+        else:
+            name = angle.lstrip('+')
+    if hex_code is not None:
+        if len(hex_code) != 7:
+            return None
+        return rgb_code(int(hex_code[1:3], 16), int(hex_code[3:5], 16), int(hex_code[5:7], 16))
+    if name is not None:
+        rgb = COLOR_NAMES.get(name.lower())
+        return rgb_code(*rgb) if rgb else None
+    return None
+
+
+@lru_cache(maxsize=2048)
+def color_state(codes):
+    """
+    Parse a Penn color spec, such as hr, hr!B, #ff0000 or <255 0 0>!+blue, into (attributes, fg, bg). fg and bg are
+    Evennia code suffixes or None.
+    """
+    attributes = list()
+    colors = {'fg': None, 'bg': None}
+    section = 'fg'
+    for match in RE_COLOR_CODES.finditer(codes):
+        if match.group('bg'):
+            section = 'bg'
+            continue
+        letter = match.group('letter')
+        if letter:
+            if letter in ANSI_ATTRIBUTES:
+                attributes.append(letter)
+            elif letter in ANSI_COLORS:
+                colors['fg' if section == 'fg' else 'bg'] = ANSI_COLORS[letter]
+            elif letter.lower() in ANSI_COLORS:
+                colors['bg'] = ANSI_COLORS[letter.lower()]
+            continue
+        value = color_value(hex_code=match.group('hex'), angle=match.group('angle'), name=match.group('name'))
+        if value:
+            colors[section] = value
+    return tuple(attributes), colors['fg'], colors['bg']
+
+
+def render_color(attributes, fg, bg):
+    output = list()
+    for attr in attributes:
+        if attr == 'h' and fg in ANSI_COLORS.values():
+            # Penn hilite on a plain ANSI color is the bright version of that color.
+            fg = fg.lower()
+            continue
+        output.append(ANSI_ATTRIBUTES[attr])
+    if fg:
+        output.append('|%s' % fg)
+    if bg:
+        output.append('|[%s' % bg)
+    return ''.join(output)
+
+
+@lru_cache(maxsize=2048)
+def penn_color(codes):
+    """
+    Translate a Penn color spec into Evennia color codes. Dumps reuse a small number of specs a great many times, so
+    results are cached on the raw spec.
+    """
+    return render_color(*color_state(codes))
+
+
+@lru_cache(maxsize=2048)
+def nested_color(specs):
+    """
+    Evennia codes for the innermost of a tuple of nested Penn color specs, outermost first. As in Penn, an inner span
+    keeps the attributes and colors of the spans around it unless it sets its own, and n drops everything outside.
+    """
+    attributes, fg, bg = list(), None, None
+    for spec in specs:
+        inner_attributes, inner_fg, inner_bg = color_state(spec)
+        if 'n' in inner_attributes:
+            attributes, fg, bg = list(), None, None
+        attributes += [attr for attr in inner_attributes if attr not in attributes]
+        fg = inner_fg or fg
+        bg = inner_bg or bg
+    return render_color(attributes, fg, bg)
+
+
+RE_PUEBLO_COMMAND = re.compile(r'(?is)^(?:send|a\s+XCH_CMD=)\s*\\?"(?P<com>.+?)\\?"')
+
+# Every piece of Penn markup process_penntext cares about, split out by a single scan. \002 opens a markup tag whose
+# kind is p (Pueblo) or c (color), a leading / closes the innermost tag of that kind, and \003 ends the tag.
+RE_PENN_TOKEN = re.compile(r'(\002[pPcC][^\003]*\003|%[rRtT])')
+
+PENN_SUBSTITUTIONS = {'%r': '\n', '%R': '\n', '%t': '\t', '%T': '\t'}
 
 
-def re_tabs(match):
-    return '\t'
+def mxp(text="", command="", hints=""):
+    if text:
+        return "|lc%s|lt%s|le" % (command, text)
+    else:
+        return "|lc%s|lt%s|le" % (command, command)
 
 
-RE_PROCESS_PENN_1 = re.compile(r'(?s)(?P<start>\002p(?P<command>.+?)\003)(?P<text>.+?)(?P<end>\002p\/\003)')
-RE_PROCESS_PENN_2 = re.compile(r'(?s)(?P<start>\002c(?P<codes>.+?)\003)(?P<text>.+?)(?P<end>\002c\/\003)')
-RE_PROCESS_PENN_3 = re.compile(r'(?is)(?P<find>%r)')
-RE_PROCESS_PENN_4 = re.compile(r'(?is)(?P<find>%t)')
+def pueblo_command(tag):
+    find = RE_PUEBLO_COMMAND.match(tag)
+    if find:
+        return find.group('com')
+    return None
 
 
-def process_penntext(text):
-    if not text:
+def close_markup(pieces, stack, kind, end, markup=True):
+    for position in range(len(stack) - 1, -1, -1):
+        if stack[position][0] == kind:
+            break
+    else:
+        return ''
+    closed_color = False
+    while len(stack) > position:
+        tag_kind, code, start = stack.pop()
+        if tag_kind == 'c':
+            closed_color = True
+            continue
+        if tag_kind != 'p' or not markup:
+            continue
+        command = pueblo_command(code)
+        if not command:
+            continue
+        # Fold everything inside the tag into the opening piece so the piece indexes stay valid.
+        text = ''.join(pieces[start + 1:end])
+        pieces[start + 1:end] = [''] * (end - start - 1)
+        pieces[start] = mxp(text=text, command=command)
+    if not closed_color or not markup:
+        return ''
+    # Evennia has no way to pop a color, so reset and reapply whatever color is still open.
+    for tag_kind, code, start in reversed(stack):
+        if tag_kind == 'c':
+            return '|n' + nested_color(code)
+    return '|n'
+
+
+def process_penntext(text, markup=True):
+    """
+    Convert Penn markup and %r/%t substitutions to Evennia text. The text is tokenized by a single split and the
+    tokens are rewritten in place before one final join.
+
+    With markup off, color spans and Pueblo links are dropped and only their text is kept. Data attributes are stored
+    that way, since Evennia's | codes would collide with the | that softcode uses as a separator.
+    """
+    if not text or ('\002' not in text and '%' not in text):
+        return text
+    pieces = RE_PENN_TOKEN.split(text)
+    if len(pieces) == 1:
         return text
-    text = RE_PROCESS_PENN_1.sub(re_pueblo,text)
-    text = RE_PROCESS_PENN_2.sub(re_color,text)
-    text = RE_PROCESS_PENN_3.sub(re_newlines,text)
-    text = RE_PROCESS_PENN_4.sub( re_tabs, text)
-    return text
+    if '\002' not in text:
+        pieces[1::2] = [PENN_SUBSTITUTIONS[token] for token in pieces[1::2]]
+        return ''.join(pieces)
+    stack = list()
+    colored = False
+    for index in range(1, len(pieces), 2):
+        token = pieces[index]
+        if token[0] == '%':
+            pieces[index] = PENN_SUBSTITUTIONS[token]
+            continue
+        kind = token[1].lower()
+        if token[2:3] == '/':
+            pieces[index] = close_markup(pieces, stack, kind, index, markup=markup)
+            continue
+        code = token[2:-1]
+        if kind == 'c':
+            # Color entries carry the specs of every open color span, so nested spans inherit from outer ones.
+            outer = next((entry[1] for entry in reversed(stack) if entry[0] == 'c'), ())
+            code = outer + (code,)
+            pieces[index] = nested_color(code) if markup else ''
+            colored = colored or bool(pieces[index])
+        else:
+            pieces[index] = ''
+        stack.append((kind, code, index))
+    if colored and any(tag_kind == 'c' for tag_kind, code, start in stack):
+        pieces.append('|n')
+    return ''.join(pieces)
+
+
+# Attributes whose text is shown to players, so their Penn markup is translated. Everything else is data and is
+# stored with markup stripped.
+DISPLAY_ATTRIBUTES = frozenset({'DESCRIBE', 'IDESCRIBE', 'SUCCESS', 'OSUCCESS', 'FAILURE', 'OFAILURE', 'DROP',
+                                'ODROP'})
+
+
+def process_attribute(name, value):
+    return process_penntext(value, markup=name.upper() in DISPLAY_ATTRIBUTES)
+
 
 RE_DBREF = re.compile(r'\!\d+$')
 
+SNAPSHOT_VERSION = 4
+
+# Attribute values up to this length are interned. Short values (flags, counters, dbrefs, empty strings) repeat
+# across thousands of objects; long softcode rarely does.
+INTERN_VALUE_LENGTH = 64
+
+
+def dbref_number(text):
+    """
+    Convert a #123 style dbref to an int. NOTHING (#-1) and anything unparseable become -1.
+    """
+    try:
+        return int(text.lstrip(u'#'))
+    except (AttributeError, ValueError):
+        return -1
+
+
+@lru_cache(maxsize=4096)
+def token_set(text):
+    """
+    Split a flag or power list into a frozenset. Identical lists share one set.
+    """
+    return frozenset(sys.intern(token) for token in (text or u'').split())
+
+
+def intern_attributes(attributes):
+    return {sys.intern(name): sys.intern(value) if len(value) <= INTERN_VALUE_LENGTH else value
+            for name, value in attributes.items()}
+
+
+class PennObject(object):
+    """
+    One parsed object from an outdb. dbref, location, exits, parent and owner are ints, with -1 for NOTHING. flags and
+    powers are frozensets of tokens. Attribute names and short values are interned, including when a record is
+    unpickled from a snapshot or a worker process, so repeated strings are shared across the whole dump.
+    """
+    __slots__ = ('dbref', 'name', 'type', 'location', 'exits', 'parent', 'owner', 'created', 'flags', 'powers',
+                 'attributes')
+
+    def __init__(self, dbref, name, type, location=-1, exits=-1, parent=-1, owner=-1, created=None, flags=frozenset(),
+                 powers=frozenset(), attributes=None):
+        self.dbref = dbref
+        self.name = name
+        self.type = type
+        self.location = location
+        self.exits = exits
+        self.parent = parent
+        self.owner = owner
+        self.created = created
+        self.flags = flags
+        self.powers = powers
+        if isinstance(attributes, Mapping) and not isinstance(attributes, dict):
+            # Lazily decoded attributes (see PennScanner) are kept as they are.
+            self.attributes = attributes
+        else:
+            self.attributes = intern_attributes(attributes or dict())
+
+    def __repr__(self):
+        return f"<PennObject #{self.dbref}: {self.name}>"
+
+    @property
+    def objid(self):
+        return f"#{self.dbref}:{self.created}"
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+        self.flags = token_set(u' '.join(sorted(self.flags)))
+        self.powers = token_set(u' '.join(sorted(self.powers)))
+        self.attributes = intern_attributes(self.attributes)
+
+# Leading bytes of the compressed formats the stdlib can stream.
+COMPRESSION_MAGIC = ((b'\x1f\x8b', gzip.open), (b'BZh', bz2.open), (b'\xfd7zXZ\x00', lzma.open))
+
+
+def outdb_opener(file):
+    """
+    The stdlib opener that decompresses this outdb, or None if it is not compressed. The format is detected from
+    the file's magic bytes rather than its name.
+    """
+    with open(file, 'rb') as raw:
+        magic = raw.read(6)
+    if magic.startswith(b'\x1f\x9d'):
+        raise ValueError(f"{file} is compressed with Unix compress (.Z), which cannot be read directly. "
+                         f"Recompress it with gzip or uncompress it first.")
+    for prefix, opener in COMPRESSION_MAGIC:
+        if magic.startswith(prefix):
+            return opener
+    return None
+
+
+def open_outdb(file):
+    """
+    Open an outdb as text, decompressing gzip, bzip2 and xz dumps on the fly.
+    """
+    if (opener := outdb_opener(file)):
+        return opener(file, 'rt', encoding='iso-8859-1', newline='\n')
+    return open(file, 'r', encoding='iso-8859-1', newline='\n')
+
+
+def outdb_signature(file):
+    """
+    Identify an outdb by its size, modification time and content hash.
+    """
+    stat = os.stat(file)
+    content = hashlib.sha1()
+    with open(file, 'rb') as outdb:
+        for block in iter(lambda: outdb.read(1 << 20), b''):
+            content.update(block)
+    return {'version': SNAPSHOT_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': content.hexdigest()}
+
+
+def snapshot_path(file):
+    return f"{file}.snapshot"
+
+
+def penn_object(dbref, main_lines, attributes):
+    """
+    Build a PennObject from the header lines of an object block (everything before attrcount).
+    """
+    fields = dict()
+    for line in main_lines:
+        subject, entry = line.split(u' ', 1)
+        entry = entry.strip(u'"')
+
+        if subject in (u'name', u'flags', u'powers'):
+            fields[subject] = entry
+        elif subject in (u'location', u'exits', u'parent', u'owner'):
+            fields[subject] = dbref_number(entry)
+        elif subject in (u'type', u'created'):
+            fields[subject] = int(entry)
+
+    return PennObject(dbref_number(dbref), fields.get(u'name'), fields.get(u'type'),
+                      location=fields.get(u'location', -1), exits=fields.get(u'exits', -1),
+                      parent=fields.get(u'parent', -1), owner=fields.get(u'owner', -1),
+                      created=fields.get(u'created'), flags=token_set(fields.get(u'flags')),
+                      powers=token_set(fields.get(u'powers')), attributes=attributes)
+
+
+def attribute_value(value_lines):
+    """
+    The raw text of an attribute from the lines of its value entry, before process_penntext.
+    """
+    value = u'\n'.join(value_lines)
+    value = value.strip(u' ')
+    value = value.strip(u'\n')
+    value_name, value = value.split(u' ', 1)
+    return value.strip(u'"')
+
+
+def parse_chunk(chunk):
+    """
+    Parse a list of (dbref, lines) object blocks. Runs inside worker processes for PennParser's parallel mode.
+    """
+    parser = PennParser(callback=lambda message: None)
+    return [parser.parse_object(dbref, lines) for dbref, lines in chunk]
+
 
 class PennParser(object):
 
-    def __init__(self, file, callback=None):
+    def __init__(self, file=None, callback=None, workers=1, chunk_size=500, snapshot=False, verbose=False):
+        self.workers = workers
+        self.verbose = verbose
+        self.snapshot = snapshot
+        self.chunk_size = chunk_size
         if callback:
             self.message_callback = callback
         else:
             self.message_callback = print
-        self.outdb = codecs.open(file, 'r', 'iso-8859-1')
         self.mush_data = {}
-        self.parse_file()
-        self.outdb.close()
-
-    def parse_file(self):
-        all_lines = self.outdb.readlines()
-        self.message_callback(f"Discovered PennMUSH Outdb with {len(all_lines)} lines.")
-        del all_lines[-1]
-        all_lines = [line.strip(u'\n') for line in all_lines]
-        start_index = all_lines.index('!0')
-        all_lines = all_lines[start_index:]
-        all_dblines = list()
-        for line_num, line_text in enumerate(all_lines):
-            if RE_DBREF.match(line_text):
-                all_dblines.append(line_num)
-        all_dblines = sorted(all_dblines)
-
-        object_dict = dict()
-
-        for count, entry in enumerate(all_dblines):
-
-            dbref = all_lines[entry].replace(u'!', u'#')
-            start_line = entry + 1
-            try:
-                end_line = all_dblines[count + 1]
-            except IndexError:
-                end_line = None
-
-            object_dict[dbref] = all_lines[start_line:end_line]
-
-        dbref_sort = sorted(object_dict.keys(), key=lambda dbref: int(dbref.strip('#')))
-        self.message_callback(f"Discovered {len(dbref_sort)} DBRefs to import.")
-
-        for dbref in dbref_sort:
-            self.message_callback(f"Beginning parsing for: {dbref}")
-            self.parse_object(dbref, object_dict[dbref])
-
+        if file:
+            for penn_object in self.iter_objects(file):
+                self.mush_data[penn_object.dbref] = penn_object
+
+    def iter_objects(self, file):
+        """
+        Stream the objects of an outdb in a single forward pass.
+
+        Yields PennObject records one at a time, so only a single object block is ever held
+        in memory. The file is opened immediately so that IOErrors surface to the caller right away.
+
+        With snapshot enabled, the parsed objects are also saved next to the outdb and later runs against an
+        identical outdb load them from there instead of parsing again.
+        """
+        if self.snapshot:
+            signature = outdb_signature(file)
+            path = snapshot_path(file)
+            snapshot = self.open_snapshot(path, signature)
+            if snapshot:
+                self.message_callback(f"Loading parsed PennMUSH Outdb from snapshot {path}.")
+                return self.load_snapshot(snapshot)
+            outdb = open_outdb(file)
+            return self.write_snapshot(path, signature, self.parse_stream(outdb))
+        outdb = open_outdb(file)
+        return self.parse_stream(outdb)
+
+    def open_snapshot(self, path, signature):
+        if not os.path.exists(path):
+            return None
+        snapshot = open(path, 'rb')
+        try:
+            if pickle.load(snapshot) == signature:
+                return snapshot
+        except (pickle.UnpicklingError, EOFError):
+            pass
+        snapshot.close()
+        self.message_callback(f"Snapshot {path} does not match the Outdb. It will be rebuilt.")
+        return None
+
+    def load_snapshot(self, snapshot):
+        progress = ImportProgress('Snapshot', callback=self.message_callback)
+        with snapshot:
+            while (record := pickle.load(snapshot)) is not None:
+                yield record
+                progress.update()
+        progress.finish()
+
+    def write_snapshot(self, path, signature, objects):
+        """
+        Pass objects through while pickling them into a snapshot. The snapshot is only moved into place once the whole
+        Outdb has been read, so an interrupted run never leaves a truncated snapshot behind.
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as snapshot:
+            pickle.dump(signature, snapshot, pickle.HIGHEST_PROTOCOL)
+            for record in objects:
+                pickle.dump(record, snapshot, pickle.HIGHEST_PROTOCOL)
+                yield record
+            pickle.dump(None, snapshot, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self.message_callback(f"Saved parsed PennMUSH Outdb snapshot to {path}.")
+
+    def iter_blocks(self, lines):
+        dbref = None
+        block = list()
+        for line in lines:
+            line = line.strip(u'\n')
+            if dbref is None:
+                if line == u'!0':
+                    dbref = u'#0'
+                continue
+            if RE_DBREF.match(line):
+                yield dbref, block
+                dbref = line.replace(u'!', u'#')
+                block = list()
+            elif line.startswith(u'***END OF DUMP***'):
+                break
+            else:
+                block.append(line)
+        if dbref is None:
+            raise ValueError("Outdb contains no objects. Could not find !0.")
+        yield dbref, block
+
+    def iter_chunks(self, blocks):
+        chunk = list()
+        for block in blocks:
+            chunk.append(block)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = list()
+        if chunk:
+            yield chunk
+
+    def parse_serial(self, blocks):
+        for dbref, lines in blocks:
+            if self.verbose:
+                self.message_callback(f"Beginning parsing for: {dbref}")
+            yield self.parse_object(dbref, lines)
+
+    def parse_parallel(self, blocks):
+        """
+        Parse chunks of object blocks in a process pool. Results are yielded in submission order, which is dbref
+        order, and only a bounded window of chunks is in flight at any time.
+        """
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for chunk in self.iter_chunks(blocks):
+                pending.append(pool.submit(parse_chunk, chunk))
+                if len(pending) >= self.workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def parse_stream(self, outdb):
+        progress = ImportProgress('Parse', callback=self.message_callback)
+        blocks = self.iter_blocks(outdb)
+        if self.workers > 1:
+            self.message_callback(f"Parsing PennMUSH Outdb with {self.workers} worker processes.")
+            results = self.parse_parallel(blocks)
+        else:
+            results = self.parse_serial(blocks)
+        try:
+            for penn_object in results:
+                yield penn_object
+                progress.update()
+        finally:
+            outdb.close()
+        progress.finish()
 
     def parse_object(self, dbref, lines):
-        object_dbref = dbref
-        object_name = None
-        object_type = None
-        object_parent = None
-        object_location = None
-        object_objid = None
-        object_created = None
-        object_exits = None
-        object_owner = None
-        object_flags = None
-        object_powers = None
-
         attribute_start = list()
         for count, line in enumerate(lines):
             if line.startswith(u'attrcount '):
@@ -133,38 +557,13 @@ class PennParser(object):
         main_lines = lines[:attribute_start]
         attribute_lines = lines[attribute_start:]
 
-        for line in main_lines:
-            subject, entry = line.split(u' ', 1)
-            entry = entry.strip(u'"')
-
-            if subject == u'name':
-                object_name = entry
-            if subject == u'location':
-                object_location = entry
-            if subject == u'exits':
-                object_exits = entry
-            if subject == u'parent':
-                object_parent = entry
-            if subject == u'type':
-                object_type = int(entry)
-            if subject == u'owner':
-                object_owner = entry
-            if subject == u'created':
-                object_created = entry
-                object_objid = u'%s:%s' % (object_dbref, entry)
-            if subject == u'flags':
-                object_flags = entry
-            if subject == u'powers':
-                object_powers = entry
-
-        self.message_callback(f"Beginning Attribute Parsing for: {dbref}. Parsing {len(attribute_lines)} lines!")
+        if self.verbose:
+            self.message_callback(f"Beginning Attribute Parsing for: {dbref}. Parsing {len(attribute_lines)} lines!")
         attributes = self.parse_attributes(attribute_lines)
-        self.message_callback(f"Finishing Attribute Parsing for: {dbref}. Parsed {len(attribute_lines)} lines!")
+        if self.verbose:
+            self.message_callback(f"Finishing Attribute Parsing for: {dbref}. Parsed {len(attribute_lines)} lines!")
 
-        self.mush_data[object_dbref] = {u'name': object_name, u'type': object_type, u'location': object_location,
-                                      u'parent': object_parent, u'objid': object_objid, u'created': object_created,
-                                      u'exits': object_exits, u'owner': object_owner, u'flags': object_flags,
-                                        u'attributes': attributes, u'powers': object_powers}
+        return penn_object(dbref, main_lines, attributes)
 
     def parse_attributes(self, attribute_lines):
 
@@ -182,13 +581,142 @@ class PennParser(object):
                 end_line = attribute_index[count + 1]
             except IndexError:
                 end_line = None
-            value_lines = attribute_lines[entry+4:end_line]
-            value = u'\n'.join(value_lines)
-            value = value.strip(u' ')
-            value = value.strip(u'\n')
-            value_name, value = value.split(u' ', 1)
-            value = value.strip(u'"')
             name = name.strip(u'"')
-            attributes[name] = process_penntext(value)
+            attributes[name] = process_attribute(name, attribute_value(attribute_lines[entry+4:end_line]))
 
         return attributes
+
+
+# Object starts, attribute name lines and the end marker, matched straight against the raw bytes of a dump.
+RE_OUTDB_INDEX = re.compile(rb'^(?:!(-?\d+)|( name "[^\n]*)|(\*\*\*END OF DUMP\*\*\*))$', re.MULTILINE)
+
+
+class LazyAttributes(Mapping):
+    """
+    The attributes of one object in a PennScanner, as a read-only mapping. Only the byte offsets are kept until a value
+    is first read; then that one attribute is decoded, run through process_attribute and remembered. names maps each
+    attribute name to its position in starts.
+    """
+    __slots__ = ('buffer', 'names', 'starts', 'end', 'values')
+
+    def __init__(self, buffer, names, starts, end):
+        self.buffer = buffer
+        self.names = names
+        self.starts = starts
+        self.end = end
+        self.values = dict()
+
+    def raw(self, name):
+        """
+        The attribute's text before process_penntext, decoded from the dump.
+        """
+        index = self.names[name]
+        start = self.starts[index]
+        end = self.starts[index + 1] if index + 1 < len(self.starts) else self.end
+        lines = self.buffer[start:end].decode('iso-8859-1').split(u'\n')
+        return attribute_value(lines[4:])
+
+    def __getitem__(self, name):
+        if name in self.values:
+            return self.values[name]
+        if name not in self.names:
+            raise KeyError(name)
+        value = self.values[name] = process_attribute(name, self.raw(name))
+        return value
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+
+class PennScanner(object):
+    """
+    Random access to the objects of an outdb without parsing it.
+
+    The dump is memory-mapped and a single regex pass records the byte offsets of every object and attribute. Object
+    headers are parsed when an object is requested, and attribute values are only decoded when read (see
+    LazyAttributes), so a stage that needs a handful of attributes never materializes the rest. Compressed dumps
+    cannot be mapped and are decompressed into memory instead.
+    """
+
+    def __init__(self, file, callback=None):
+        if callback:
+            self.message_callback = callback
+        else:
+            self.message_callback = print
+        self.file = file
+        self.mapped = None
+        if (opener := outdb_opener(file)):
+            with opener(file, 'rb') as outdb:
+                self.buffer = outdb.read()
+        else:
+            with open(file, 'rb') as outdb:
+                self.buffer = self.mapped = mmap.mmap(outdb.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = dict()
+        self.index()
+
+    def index(self):
+        progress = ImportProgress('Index', callback=self.message_callback)
+        dbref = start = None
+        names = dict()
+        starts = array('q')
+        for match in RE_OUTDB_INDEX.finditer(self.buffer):
+            object_dbref, name_line, end_marker = match.groups()
+            if dbref is None:
+                if object_dbref == b'0':
+                    dbref, start = 0, match.end() + 1
+                continue
+            if name_line is not None:
+                name = name_line.decode('iso-8859-1').strip(u' ').split(u' ', 1)[1].strip(u'"')
+                names[sys.intern(name)] = len(starts)
+                starts.append(match.start())
+                continue
+            self.offsets[dbref] = (start, match.start(), names, starts)
+            progress.update()
+            if end_marker is not None:
+                break
+            dbref, start = int(object_dbref), match.end() + 1
+            names = dict()
+            starts = array('q')
+        else:
+            if dbref is None:
+                raise ValueError("Outdb contains no objects. Could not find !0.")
+            self.offsets[dbref] = (start, len(self.buffer), names, starts)
+        progress.finish()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        for dbref in self.offsets:
+            yield self.get(dbref)
+
+    def __contains__(self, dbref):
+        return dbref in self.offsets
+
+    def get(self, dbref):
+        """
+        The PennObject for an int dbref, with LazyAttributes in place of decoded attributes.
+        """
+        start, end, names, starts = self.offsets[dbref]
+        header_end = self.buffer.find(b'\nattrcount ', start - 1, end)
+        if header_end < 0:
+            raise ValueError(f"Object #{dbref} has no attrcount line.")
+        main_lines = self.buffer[start:header_end].decode('iso-8859-1').split(u'\n') if header_end > start else list()
+        return penn_object(f"#{dbref}", main_lines, LazyAttributes(self.buffer, names, starts, end))
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,332 @@
+import datetime
+import pytz
+
+from collections import defaultdict
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from athanor.utils.text import penn_substitutions
+
+from . models import MushObject, MushAttribute, MushImportJournal, MushImportRecord, attribute_names, \
+    object_resolver, cobj, pmatch
+
+
+def from_unixtimestring(timestring):
+    try:
+        convert = datetime.datetime.fromtimestamp(int(timestring), tz=pytz.utc)
+    except (TypeError, ValueError):
+        return None
+    return convert
+
+
+class PennObjectLoader(object):
+    """
+    Writes a stream of parsed PennMUSH objects into MushObject and MushAttribute using batched bulk inserts.
+
+    Objects are inserted without their links in the first pass, since a link may point at an object that has not
+    been read yet. Once every object exists the parent/owner/location/destination links are filled in with
+    bulk_update. Every batch is written inside a single transaction.
+    """
+
+    def __init__(self, callback=None, batch_size=1000):
+        if callback:
+            self.message_callback = callback
+        else:
+            self.message_callback = print
+        self.batch_size = batch_size
+        self.dbref_map = dict()
+        self.link_map = dict()
+        self.object_count = 0
+        self.attribute_count = 0
+
+    def load(self, penn_objects):
+        attribute_names.load()
+        batch = list()
+        for penn_object in penn_objects:
+            batch.append(penn_object)
+            if len(batch) >= self.batch_size:
+                self.write_objects(batch)
+                batch = list()
+        if batch:
+            self.write_objects(batch)
+        self.write_links()
+        # bulk_create and bulk_update skip the signals that keep the resolver current.
+        object_resolver.clear()
+        import_session.clear()
+        return self.object_count, self.attribute_count
+
+    def write_objects(self, batch):
+        objids = [penn_object.objid for penn_object in batch]
+        with transaction.atomic():
+            existing = dict(MushObject.objects.filter(objid__in=objids).values_list('objid', 'id'))
+            new_objects = [MushObject(dbref=f"#{penn_object.dbref}", objid=penn_object.objid, type=penn_object.type,
+                                      name=penn_object.name, flags=' '.join(sorted(penn_object.flags)),
+                                      powers=' '.join(sorted(penn_object.powers)),
+                                      created=from_unixtimestring(penn_object.created))
+                           for penn_object in batch if penn_object.objid not in existing]
+            MushObject.objects.bulk_create(new_objects, batch_size=self.batch_size)
+            # Not every backend hands primary keys back from bulk_create, so look them up again.
+            ids = dict(MushObject.objects.filter(objid__in=objids).values_list('objid', 'id'))
+
+            attribute_names.preload({attr for penn_object in batch if penn_object.objid not in existing
+                                     for attr in penn_object.attributes})
+            new_attributes = list()
+            for penn_object in batch:
+                obj_id = ids[penn_object.objid]
+                self.dbref_map[penn_object.dbref] = obj_id
+                self.link_map[obj_id] = (penn_object.type, penn_object.parent, penn_object.owner,
+                                         penn_object.location, penn_object.exits)
+                if penn_object.objid in existing:
+                    continue
+                for attr, value in penn_object.attributes.items():
+                    new_attributes.append(MushAttribute(dbref_id=obj_id, attr_id=attribute_names.get(attr, create=True),
+                                                        value=penn_substitutions(value)))
+            MushAttribute.objects.bulk_create(new_attributes, batch_size=self.batch_size)
+
+        self.object_count += len(new_objects)
+        self.attribute_count += len(new_attributes)
+        self.message_callback(f"Inserted {self.object_count} MushObjects and {self.attribute_count} MushAttributes.")
+
+    def link_object(self, obj_id, links):
+        object_type, parent, owner, location, exits = links
+        obj = MushObject(id=obj_id, parent_id=self.dbref_map.get(parent, None), owner_id=self.dbref_map.get(owner, None))
+        if object_type == 4:  # For exits!
+            obj.destination_id = self.dbref_map.get(location, None)
+            obj.location_id = self.dbref_map.get(exits, None)
+        else:
+            obj.location_id = self.dbref_map.get(location, None)
+        return obj
+
+    def write_links(self):
+        fields = ['parent', 'owner', 'location', 'destination']
+        batch = list()
+        linked = 0
+        for obj_id, links in self.link_map.items():
+            batch.append(self.link_object(obj_id, links))
+            if len(batch) >= self.batch_size:
+                with transaction.atomic():
+                    MushObject.objects.bulk_update(batch, fields, batch_size=self.batch_size)
+                linked += len(batch)
+                batch = list()
+                self.message_callback(f"Linked {linked} of {len(self.link_map)} MushObjects.")
+        if batch:
+            with transaction.atomic():
+                MushObject.objects.bulk_update(batch, fields, batch_size=self.batch_size)
+            linked += len(batch)
+            self.message_callback(f"Linked {linked} of {len(self.link_map)} MushObjects.")
+
+
+def chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ImportSession(object):
+    """
+    Identity map shared by every @penn stage in this process. Each objid is resolved to its character (the Evennia
+    object if one was imported, otherwise the MushObject, made as a recreated ghost when the outdb never had it) and
+    to its EntityMap once, and then served from memory.
+
+    prepare() resolves a whole stage's worth of objids up front, creating the missing ghosts and mushdb EntityMaps
+    with bulk_create instead of one get_or_create each.
+    """
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.characters = dict()
+        self.accounts = dict()
+        self.entities = dict()
+
+    def clear(self):
+        self.characters.clear()
+        self.accounts.clear()
+        self.entities.clear()
+
+    def forget(self, objid):
+        self.characters.pop(objid, None)
+        self.accounts.pop(objid, None)
+        self.entities.pop(objid, None)
+
+    def ghost(self, objid, name, **kwargs):
+        dbref, timestamp = objid.split(':', 1)
+        return MushObject(dbref=dbref, objid=objid, name=name, created=from_unixtimestring(timestamp), recreated=True,
+                          **kwargs)
+
+    def character(self, objid, name=None):
+        if objid in self.characters:
+            return self.characters[objid]
+        if (found := pmatch(objid)):
+            pass
+        elif (obj_id := object_resolver.object_id(objid)) is not None:
+            found = MushObject.objects.get(id=obj_id)
+        else:
+            found = self.ghost(objid, name, type=8)
+            found.save()
+        self.characters[objid] = found
+        return found
+
+    def account(self, objid, name, email):
+        if objid in self.accounts:
+            return self.accounts[objid]
+        par = cobj(abbr='accounts')
+        if not (found := par.children.filter(objid=objid).first()):
+            found = self.ghost(objid, name, location=par, owner=par, parent=par, type=par.type)
+            found.save()
+        self.accounts[objid] = found
+        return found
+
+    def entity(self, objid, name=None):
+        if objid not in self.entities:
+            self.entities[objid] = self.character(objid, name).entity
+        return self.entities[objid]
+
+    def prepare(self, characters):
+        """
+        Resolve the characters and entities of many (objid, name) pairs in bulk.
+        """
+        from .. core.gameentity import EntityMap
+        names = {objid: name for objid, name in characters if objid not in self.entities}
+        missing = [objid for objid in names if object_resolver.object_id(objid) is None]
+        with transaction.atomic():
+            MushObject.objects.bulk_create([self.ghost(objid, names[objid], type=8) for objid in missing],
+                                           batch_size=self.batch_size, ignore_conflicts=True)
+        # bulk_create sends no signals, so tell the resolver about the new ghosts.
+        for chunk in chunks(missing, self.batch_size):
+            for row in MushObject.objects.filter(objid__in=chunk).values_list('id', 'dbref', 'objid', 'obj_id'):
+                object_resolver.add(*row)
+
+        mush_objects = dict()
+        for chunk in chunks(names, self.batch_size):
+            for obj in MushObject.objects.filter(objid__in=chunk):
+                if obj.obj_id is None:
+                    self.characters[obj.objid] = mush_objects[obj.id] = obj
+        entities = dict()
+        for chunk in chunks(mush_objects, self.batch_size):
+            entities.update((entity.db_instance, entity) for entity in
+                            EntityMap.objects.filter(db_model='mushdb', db_instance__in=chunk))
+        with transaction.atomic():
+            EntityMap.objects.bulk_create([EntityMap(db_model='mushdb', db_instance=obj.id, db_owner_date_created=obj.created,
+                                                     db_key=obj.name)
+                                           for obj in mush_objects.values() if obj.id not in entities],
+                                          batch_size=self.batch_size)
+        for chunk in chunks([obj_id for obj_id in mush_objects if obj_id not in entities], self.batch_size):
+            entities.update((entity.db_instance, entity) for entity in
+                            EntityMap.objects.filter(db_model='mushdb', db_instance__in=chunk))
+        for obj_id, entity in entities.items():
+            self.entities[mush_objects[obj_id].objid] = entity
+
+        # Characters that became Evennia objects resolve their entities through those.
+        for objid, name in names.items():
+            self.entity(objid, name)
+        return len(names)
+
+
+import_session = ImportSession()
+
+
+class ImportJournal(object):
+    """
+    Durable checkpoint for one stage of the @penn import.
+
+    Rows are handed to a handler in batches. Each batch commits in one transaction together with the key of its
+    last row, so a failed run leaves no partial batch behind and a later run picks up right after the last committed
+    row. Rows must arrive in the same deterministic order every run.
+
+    Whatever the handler returns for a row is remembered against that row's key, so stages that build lookup maps
+    (such as group_id -> Faction) can rebuild them with mapping() when resuming.
+    """
+
+    def __init__(self, stage, callback=None, batch_size=500):
+        if callback:
+            self.message_callback = callback
+        else:
+            self.message_callback = print
+        self.stage = stage
+        self.batch_size = batch_size
+        self.entry, created = MushImportJournal.objects.get_or_create(stage=stage)
+
+    @classmethod
+    def reset(cls, stage=None):
+        journals = MushImportJournal.objects.all()
+        records = MushImportRecord.objects.all()
+        if stage:
+            journals = journals.filter(stage__istartswith=stage)
+            records = records.filter(stage__istartswith=stage)
+        records.delete()
+        return journals.delete()[0]
+
+    def mapping(self, key=str):
+        """
+        Rebuild the source key -> object map of everything recorded by this stage.
+        """
+        by_type = defaultdict(dict)
+        for source, content_type, object_id in MushImportRecord.objects.filter(stage=self.stage).values_list(
+                'source', 'content_type', 'object_id'):
+            by_type[content_type][object_id] = source
+        found = dict()
+        for content_type, sources in by_type.items():
+            model = ContentType.objects.get_for_id(content_type).model_class()
+            for object_id, obj in model.objects.in_bulk(list(sources)).items():
+                found[key(sources[object_id])] = obj
+        return found
+
+    def pending(self, rows, key):
+        rows = iter(rows)
+        position = self.entry.position
+        if position is None:
+            return rows
+        for row in rows:
+            if str(key(row)) == position:
+                self.message_callback(f"Resuming {self.stage} after {position}. {self.entry.count} rows were already done.")
+                return rows
+        raise ValueError(f"Checkpoint {position} of {self.stage} was not found in its source. Reset the journal with @penn/reset {self.stage}.")
+
+    def batches(self, rows):
+        batch = list()
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = list()
+        if batch:
+            yield batch
+
+    def run(self, rows, key, handler, progress=None, flush=None, weight=None):
+        """
+        Call handler on every row after the checkpoint. Returns the number of rows processed this run.
+
+        If given, flush is called at the end of every batch, inside its transaction, so handlers can queue up rows
+        and bulk_create them once per batch. Stages that hand over grouped rows can pass weight, the number of source
+        rows a row stands for, and the checkpoint count and progress are then kept in source rows.
+        """
+        if self.entry.finished:
+            self.message_callback(f"{self.stage} was already imported. Skipping.")
+            return 0
+        if progress:
+            progress.resume(self.entry.count)
+        processed = 0
+        for batch in self.batches(self.pending(rows, key)):
+            with transaction.atomic():
+                records = list()
+                count = 0
+                for row in batch:
+                    if (result := handler(row)) is not None:
+                        content_type = ContentType.objects.get_for_model(result, for_concrete_model=False)
+                        records.append(MushImportRecord(stage=self.stage, source=str(key(row)),
+                                                        content_type=content_type, object_id=result.pk))
+                    size = weight(row) if weight else 1
+                    count += size
+                    if progress:
+                        progress.update(size)
+                if flush:
+                    flush()
+                MushImportRecord.objects.bulk_create(records)
+                self.entry.position = str(key(batch[-1]))
+                self.entry.count += count
+                self.entry.save()
+            processed += len(batch)
+        self.entry.finished = True
+        self.entry.save()
+        if progress:
+            progress.finish()
+        return processed
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('objects', '__first__'),
+        ('scripts', '__first__'),
+        ('factions', '__first__'),
+        ('athanor_forum', '__first__'),
+        ('themes', '__first__'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MushAttributeName',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=200, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MushObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dbref', models.CharField(db_index=True, max_length=15)),
+                ('objid', models.CharField(db_index=True, max_length=30, unique=True)),
+                ('type', models.PositiveSmallIntegerField(db_index=True)),
+                ('name', models.CharField(max_length=80)),
+                ('created', models.DateTimeField()),
+                ('flags', models.TextField(blank=True)),
+                ('powers', models.TextField(blank=True)),
+                ('recreated', models.BooleanField(default=False)),
+                ('account', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mush', to=settings.AUTH_USER_MODEL)),
+                ('board', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mush', to='athanor_forum.ForumBoardBridge')),
+                ('destination', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='exits_to', to='athanor_mush.MushObject')),
+                ('fclist', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mush', to='themes.ThemeBridge')),
+                ('group', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mush', to='factions.FactionBridge')),
+                ('location', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='contents', to='athanor_mush.MushObject')),
+                ('obj', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mush', to='objects.ObjectDB')),
+                ('owner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='owned', to='athanor_mush.MushObject')),
+                ('parent', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='children', to='athanor_mush.MushObject')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ThemeBridge',
+            fields=[
+                ('db_script', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='theme_bridge', serialize=False, to='scripts.ScriptDB')),
+                ('db_name', models.CharField(max_length=255)),
+                ('db_iname', models.CharField(max_length=255, unique=True)),
+                ('db_cname', models.CharField(max_length=255)),
+            ],
+            options={
+                'verbose_name': 'Theme',
+                'verbose_name_plural': 'Themes',
+            },
+        ),
+        migrations.CreateModel(
+            name='ThemeParticipant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_list_type', models.CharField(max_length=50)),
+                ('db_object', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='themes', to='objects.ObjectDB')),
+                ('db_theme', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='athanor_mush.ThemeBridge')),
+            ],
+            options={
+                'verbose_name': 'ThemeParticipant',
+                'verbose_name_plural': 'ThemeParticipants',
+                'unique_together': {('db_theme', 'db_object')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MushAttribute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.TextField(blank=True)),
+                ('attr', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, related_name='characters', to='athanor_mush.MushAttributeName')),
+                ('dbref', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attrs', to='athanor_mush.MushObject')),
+            ],
+            options={
+                'unique_together': {('dbref', 'attr')},
+            },
+        ),
+    ]
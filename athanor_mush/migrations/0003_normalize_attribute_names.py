@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+def normalize_attribute_names(apps, schema_editor):
+    """
+    Upper-case every MushAttributeName. Where both a mixed-case and an upper-cased name exist, attributes are moved
+    onto the upper-cased name. If an object has the attribute under both names, the upper-cased value wins.
+    """
+    MushAttributeName = apps.get_model('athanor_mush', 'MushAttributeName')
+    MushAttribute = apps.get_model('athanor_mush', 'MushAttribute')
+
+    canonical = dict()
+    for attr_id, key in MushAttributeName.objects.order_by('id').values_list('id', 'key'):
+        if key == key.upper():
+            canonical[key] = attr_id
+
+    for attr_name in MushAttributeName.objects.order_by('id'):
+        key = attr_name.key.upper()
+        if attr_name.key == key:
+            continue
+        if key not in canonical:
+            attr_name.key = key
+            attr_name.save()
+            canonical[key] = attr_name.id
+            continue
+        target = canonical[key]
+        taken = set(MushAttribute.objects.filter(attr_id=target).values_list('dbref_id', flat=True))
+        duplicates = [attr_id for attr_id, dbref_id in
+                      MushAttribute.objects.filter(attr_id=attr_name.id).values_list('id', 'dbref_id')
+                      if dbref_id in taken]
+        for start in range(0, len(duplicates), 500):
+            MushAttribute.objects.filter(id__in=duplicates[start:start + 500]).delete()
+        MushAttribute.objects.filter(attr_id=attr_name.id).update(attr_id=target)
+        attr_name.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('athanor_mush', '0002_import_journal'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_attribute_names, migrations.RunPython.noop),
+    ]
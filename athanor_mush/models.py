@@ -1,9 +1,51 @@
 import hashlib
-from django.db import models
-from django.db.models import Q
-from athanor.utils.text import partial_match
+from collections import OrderedDict
+from django.db import connection, models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from evennia.utils.utils import lazy_property
 from evennia.typeclasses.models import SharedMemoryModel
+from . wildcard import compile_wildcard, prefix_filter, wildcard_filter
+
+
+class MushObjectManager(models.Manager):
+
+    def attr_map(self, objects, attrnames, default='', check_parent=True):
+        """
+        mushget() for many objects and attributes at once. objects is a MushObject queryset, or any iterable of
+        MushObjects or ids. Returns {object id: {attrname: value}} holding every requested name, with default where an
+        object does not have it. The objects and all of their parent chains are searched in a single query, however
+        many objects and attributes are asked for.
+        """
+        if not isinstance(objects, models.QuerySet):
+            objects = self.filter(id__in=[getattr(obj, 'id', obj) for obj in objects])
+        attr_ids = {attr_id: name for name in attrnames if (attr_id := attribute_names.get(name)) is not None}
+        found = {obj_id: {name: default for name in attrnames} for obj_id in objects.values_list('id', flat=True)}
+        if not attr_ids or not found:
+            return found
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        attr_table = connection.ops.quote_name(MushAttribute._meta.db_table)
+        start_sql, start_params = objects.values('id').query.sql_with_params()
+        placeholders = ', '.join(['%s'] * len(attr_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"WITH RECURSIVE chain (origin, id, parent_id, depth) AS ("
+                           f"SELECT id, id, parent_id, 0 FROM {table} WHERE id IN ({start_sql}) "
+                           f"UNION ALL SELECT chain.origin, o.id, o.parent_id, chain.depth + 1 FROM {table} o "
+                           f"INNER JOIN chain ON o.id = chain.parent_id WHERE chain.depth < %s) "
+                           f"SELECT chain.origin, chain.depth, a.attr_id, a.value FROM chain "
+                           f"INNER JOIN {attr_table} a ON a.dbref_id = chain.id AND a.attr_id IN ({placeholders}) "
+                           f"ORDER BY chain.origin, chain.depth",
+                           [*start_params, MAX_PARENT_DEPTH if check_parent else 0, *attr_ids])
+            rows = cursor.fetchall()
+        done = set()
+        for origin, depth, attr_id, value in rows:
+            if (origin, attr_id) in done:
+                continue
+            done.add((origin, attr_id))
+            # An empty value inherited from a parent counts as not found.
+            if depth == 0 or value:
+                found[origin][attr_ids[attr_id]] = value.replace('%r', '%R').replace('%t', '%T')
+        return found
 
 
 class MushObject(models.Model):
@@ -26,6 +68,8 @@ class MushObject(models.Model):
     powers = models.TextField(blank=True)
     recreated = models.BooleanField(default=False)
 
+    objects = MushObjectManager()
+
     def __unicode__(self):
         return self.name
 
@@ -38,63 +82,126 @@ class MushObject(models.Model):
             return ali.split(';')
         return []
 
+    def cache_attributes(self):
+        """
+        Opt this object into the attribute cache. All of its attributes are loaded in one query and mushget, hasattr
+        and lattr are answered from memory until a MushAttribute of this object is saved or deleted.
+        """
+        return attribute_cache.enable(self.id)
+
+    def uncache_attributes(self):
+        attribute_cache.disable(self.id)
+
+    def ancestor_ids(self):
+        """
+        Return the ids of this object and its parent chain, nearest first, fetched in a single query.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f"{ancestor_chain_sql()} SELECT id FROM chain ORDER BY depth", [self.id, MAX_PARENT_DEPTH])
+            # A parent cycle repeats ids until the depth limit, so only keep the first sighting of each.
+            return list(dict.fromkeys(row[0] for row in cursor.fetchall()))
+
+    def inherited_attribute(self, attrname, start=None):
+        """
+        Find attrname on this object or its nearest ancestor with a single query. Returns a (depth, value) tuple, where
+        depth 0 is the object the search started from, or None if no object in the chain has it.
+        """
+        if (attr_id := attribute_names.get(attrname)) is None:
+            return None
+        attr_table = connection.ops.quote_name(MushAttribute._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f"{ancestor_chain_sql()} SELECT chain.depth, a.value FROM chain "
+                           f"INNER JOIN {attr_table} a ON a.dbref_id = chain.id WHERE a.attr_id = %s "
+                           f"ORDER BY chain.depth LIMIT 1",
+                           [start or self.id, MAX_PARENT_DEPTH, attr_id])
+            return cursor.fetchone()
+
+    def get_attribute(self, attrname):
+        """
+        Attribute names are stored upper-cased, so this is an exact match on the interned name id rather than a
+        case-insensitive scan of the object's attributes.
+        """
+        if (attr_id := attribute_names.get(attrname)) is None:
+            return None
+        return self.attrs.filter(attr_id=attr_id).first()
+
     def mushget(self, attrname, default='', check_parent=True):
         if not attrname:
             return False
-        attr = self.attrs.filter(attr__key__iexact=attrname).first()
-        if attr:
-            return attr.value.replace('%r', '%R').replace('%t', '%T')
-        if check_parent and self.parent:
-            parent_attr = self.parent.mushget(attrname, check_parent=check_parent)
-            if parent_attr:
-                return parent_attr
-            else:
-                return default
-        else:
+        found = None
+        if (cached := attribute_cache.get(self.id)) is not None:
+            if (value := cached.get(attrname.upper(), None)) is not None:
+                found = (0, value)
+            elif check_parent and self.parent_id:
+                if (found := self.inherited_attribute(attrname, start=self.parent_id)) is not None:
+                    found = (found[0] + 1, found[1])
+        elif check_parent:
+            found = self.inherited_attribute(attrname)
+        elif (attr := self.get_attribute(attrname)):
+            found = (0, attr.value)
+        if found is None:
+            return default
+        depth, value = found
+        # An empty value inherited from a parent counts as not found.
+        if depth and not value:
             return default
+        return value.replace('%r', '%R').replace('%t', '%T')
 
     def hasattr(self, attrname):
         if not attrname:
             return False
-        attr = self.attrs.filter(attr__key__iexact=attrname).first()
-        return bool(attr)
+        if (cached := attribute_cache.get(self.id)) is not None:
+            return attrname.upper() in cached
+        return self.get_attribute(attrname) is not None
 
     def lattr(self, attrpattern):
         if not attrpattern:
             return list()
-        attrpattern = attrpattern.replace('`**','`\S+')
-        attrpattern = r'^%s$' % attrpattern.replace('*','\w+')
-        check = [attr.attr.key for attr in self.attrs.filter(attr__key__iregex=attrpattern)]
-        if not check:
-            return list()
-        return check
+        if (cached := attribute_cache.get(self.id)) is not None:
+            return wildcard_filter(cached, attrpattern)
+        prefix, regex = compile_wildcard(attrpattern)
+        keys = self.attrs.filter(**prefix_filter('attr__key', prefix)).values_list('attr__key', flat=True)
+        return [key for key in keys if regex.fullmatch(key)]
 
     def lattrp(self, attrpattern):
-        attrset = list()
-        attrset += self.lattr(attrpattern)
-        if self.parent:
-            attrset += self.parent.lattrp(attrpattern)
-        return list(set(attrset))
+        return list(set(self.lattrp2(attrpattern)))
 
     def lattrp2(self, attrpattern):
+        if not attrpattern:
+            return list()
         attrset = list()
-        attrset += self.lattr(attrpattern)
-        if self.parent:
-            attrset += self.parent.lattrp2(attrpattern)
+        ids = self.ancestor_ids()
+        if attribute_cache.get(self.id) is not None:
+            attrset += self.lattr(attrpattern)
+            ids = ids[1:]
+        if not ids:
+            return attrset
+        prefix, regex = compile_wildcard(attrpattern)
+        found = dict()
+        for dbref_id, key in MushAttribute.objects.filter(dbref_id__in=ids, **prefix_filter('attr__key', prefix)).values_list(
+                'dbref_id', 'attr__key'):
+            if regex.fullmatch(key):
+                found.setdefault(dbref_id, list()).append(key)
+        for obj_id in ids:
+            attrset += found.get(obj_id, list())
         return attrset
 
     def getstat(self, attrname, stat):
         attr = self.mushget(attrname)
         if not attr:
             return
-        attr_dict = dict()
-        for element in attr.split('|'):
-            name, value = element.split('~', 1)
-            attr_dict[name] = value
-        find_stat = partial_match(stat, attr_dict)
-        if not find_stat:
-            return
-        return attr_dict[find_stat]
+        return stat_cache.get(attrname, attr).find(stat)
+
+    def getstats(self, attrname, stats):
+        """
+        Look up several stats from one name~value|name~value attribute, parsing it at most once. Returns a dict of
+        each requested stat to its value, or None where it doesn't match.
+        """
+        attr = self.mushget(attrname)
+        if not attr:
+            return {stat: None for stat in stats}
+        parsed = stat_cache.get(attrname, attr)
+        return {stat: parsed.find(stat) for stat in stats}
 
     @property
     def exits(self):
@@ -127,17 +234,138 @@ class MushObject(models.Model):
         return found
 
 
+# Penn refuses parent chains deeper than this, and it also bounds the walk if the imported parents form a cycle.
+MAX_PARENT_DEPTH = 10
+
+
+def ancestor_chain_sql():
+    """
+    A recursive CTE named chain of (id, parent_id, depth) rows for an object and its parents. Takes the starting id and
+    the maximum depth as parameters.
+    """
+    table = connection.ops.quote_name(MushObject._meta.db_table)
+    return (f"WITH RECURSIVE chain (id, parent_id, depth) AS ("
+            f"SELECT id, parent_id, 0 FROM {table} WHERE id = %s "
+            f"UNION ALL SELECT o.id, o.parent_id, chain.depth + 1 FROM {table} o "
+            f"INNER JOIN chain ON o.id = chain.parent_id WHERE chain.depth < %s)")
+
+
+class MushObjectResolver(object):
+    """
+    Process-wide map of dbrefs and objids to MushObject ids, used by pmatch, objmatch and cobj.
+
+    Penn reuses dbrefs, so a dbref maps to every id that ever held it, lowest first, while an objid maps to exactly
+    one. Lookups that miss are read from the database and remembered. After warm() the maps hold every MushObject and
+    a miss is answered without a query. Saving a MushObject updates its entry, and saving the Core Code Parent or one
+    of its attributes forgets the COBJ table. Bulk writes do not send signals, so code doing those must clear()
+    afterwards.
+    """
+
+    def __init__(self):
+        self.rows = dict()
+        self.dbrefs = dict()
+        self.objids = dict()
+        self.cobjs = None
+        self.ccp_id = None
+        self.warmed = False
+
+    def add(self, obj_id, dbref, objid, game_obj_id):
+        self.forget(obj_id)
+        self.rows[obj_id] = (dbref, objid, game_obj_id)
+        ids = self.dbrefs.setdefault(dbref, list())
+        ids.append(obj_id)
+        ids.sort()
+        self.objids[objid] = obj_id
+
+    def forget(self, obj_id):
+        if (row := self.rows.pop(obj_id, None)) is None:
+            return
+        dbref, objid, game_obj_id = row
+        if obj_id in (ids := self.dbrefs.get(dbref, list())):
+            ids.remove(obj_id)
+        if self.objids.get(objid) == obj_id:
+            del self.objids[objid]
+
+    def warm(self):
+        self.clear()
+        for row in MushObject.objects.values_list('id', 'dbref', 'objid', 'obj_id'):
+            self.add(*row)
+        self.warmed = True
+        return len(self.rows)
+
+    def clear(self):
+        self.rows.clear()
+        self.dbrefs.clear()
+        self.objids.clear()
+        self.cobjs = None
+        self.warmed = False
+
+    def resolve(self, dbref):
+        """
+        Every MushObject id known by this dbref or objid. Objids contain a colon and dbrefs never do, so only one
+        indexed column has to be searched.
+        """
+        if ':' in dbref:
+            if dbref in self.objids:
+                return [self.objids[dbref]]
+            field = 'objid'
+        else:
+            if self.dbrefs.get(dbref):
+                return self.dbrefs[dbref]
+            field = 'dbref'
+        if self.warmed:
+            return list()
+        rows = list(MushObject.objects.filter(**{field: dbref}).values_list('id', 'dbref', 'objid', 'obj_id'))
+        for row in rows:
+            self.add(*row)
+        return sorted(row[0] for row in rows)
+
+    def object_id(self, dbref, with_obj=False):
+        for obj_id in self.resolve(dbref):
+            if not with_obj or self.rows[obj_id][2] is not None:
+                return obj_id
+        return None
+
+    def cobj(self, abbr):
+        """
+        The dbref stored in the Core Code Parent's COBJ`<abbr> attribute. Raises ValueError like cobj() does.
+        """
+        if self.cobjs is None:
+            code_object = MushObject.objects.filter(name='Core Code Parent <CCP>').first()
+            if not code_object:
+                raise ValueError("Core Code Parent <CCP> not found!")
+            self.ccp_id = code_object.id
+            self.cobjs = {key[5:]: value for key, value in
+                          code_object.attrs.filter(**prefix_filter('attr__key', 'COBJ`')).values_list('attr__key', 'value')
+                          if key.startswith('COBJ`')}
+        abbr = abbr.upper()
+        if abbr not in self.cobjs:
+            raise ValueError("COBJ`%s not found!" % abbr)
+        return self.cobjs[abbr]
+
+
+object_resolver = MushObjectResolver()
+
+
+@receiver(post_save, sender=MushObject)
+def update_object_resolver(sender, instance, **kwargs):
+    if instance.id == object_resolver.ccp_id or instance.name == 'Core Code Parent <CCP>':
+        object_resolver.cobjs = None
+    if instance.id in object_resolver.rows or object_resolver.warmed:
+        object_resolver.add(instance.id, instance.dbref, instance.objid, instance.obj_id)
+
+
+@receiver(post_delete, sender=MushObject)
+def forget_resolved_object(sender, instance, **kwargs):
+    if instance.id == object_resolver.ccp_id:
+        object_resolver.cobjs = None
+    object_resolver.forget(instance.id)
+
+
 def cobj(abbr=None):
     if not abbr:
         raise ValueError("No abbreviation entered!")
-    code_object = MushObject.objects.filter(name='Core Code Parent <CCP>').first()
-    if not code_object:
-        raise ValueError("Core Code Parent <CCP> not found!")
-    search_name = 'COBJ`%s' % abbr.upper()
-    found_attr = code_object.attrs.filter(attr__key=search_name).first()
-    if not found_attr:
-        raise ValueError("COBJ`%s not found!" % abbr.upper())
-    dbref = found_attr.value
+    dbref = object_resolver.cobj(abbr)
     if not dbref:
         raise ValueError("Cannot find DBREF of %s" % abbr.upper())
     return objmatch(dbref)
@@ -146,34 +374,203 @@ def cobj(abbr=None):
 def pmatch(dbref=None):
     if not dbref:
         return False
-    find = MushObject.objects.filter(Q(dbref=dbref) | Q(objid=dbref)).exclude(obj=None).first()
-    if find:
-        return find.obj
-    return False
+    obj_id = object_resolver.object_id(dbref, with_obj=True)
+    if obj_id is None:
+        return False
+    # ObjectDB is an idmapper model, so this is usually answered from its cache.
+    return MushObject.obj.field.related_model.objects.get(id=object_resolver.rows[obj_id][2])
 
 
 def objmatch(dbref=None):
     if not dbref:
         return False
-    find = MushObject.objects.filter(Q(dbref=dbref) | Q(objid=dbref)).first()
-    if find:
-        return find
-    return False
+    obj_id = object_resolver.object_id(dbref)
+    if obj_id is None:
+        return False
+    return MushObject.objects.get(id=obj_id)
 
 
 class MushAttributeName(models.Model):
+    # Penn attribute names are case-insensitive. They are always stored upper-cased so lookups can be exact matches
+    # against the unique index.
     key = models.CharField(max_length=200, unique=True, db_index=True)
 
+    def save(self, *args, **kwargs):
+        self.key = self.key.upper()
+        super().save(*args, **kwargs)
+
+
+class MushAttributeNameRegistry(object):
+    """
+    Process-wide map of upper-cased attribute names to MushAttributeName ids. Attribute names are never renamed,
+    so once an id is known it is handed out without touching the database again.
+    """
+
+    def __init__(self):
+        self.ids = dict()
+
+    def load(self):
+        self.ids.update(MushAttributeName.objects.values_list('key', 'id'))
+
+    def preload(self, names):
+        """
+        Make sure every name in names exists, creating the missing ones with a single bulk insert. Names already
+        in the registry cost nothing, so this is cheap to call once per import batch.
+        """
+        missing = {name.upper() for name in names} - set(self.ids)
+        if missing:
+            self.ids.update(MushAttributeName.objects.filter(key__in=missing).values_list('key', 'id'))
+            missing -= set(self.ids)
+        if missing:
+            MushAttributeName.objects.bulk_create([MushAttributeName(key=key) for key in sorted(missing)],
+                                                  batch_size=1000, ignore_conflicts=True)
+            self.ids.update(MushAttributeName.objects.filter(key__in=missing).values_list('key', 'id'))
+        return self.ids
+
+    def get(self, name, create=False):
+        key = name.upper()
+        if (found := self.ids.get(key, None)) is not None:
+            return found
+        if create:
+            attr_name, created = MushAttributeName.objects.get_or_create(key=key)
+        elif not (attr_name := MushAttributeName.objects.filter(key=key).first()):
+            return None
+        found = self.ids[key] = attr_name.id
+        return found
+
+
+attribute_names = MushAttributeNameRegistry()
+
 
 class MushAttribute(models.Model):
     dbref = models.ForeignKey(MushObject, related_name='attrs', on_delete=models.CASCADE)
-    attr = models.ForeignKey(MushAttributeName, related_name='characters', on_delete=models.SET_NULL)
+    attr = models.ForeignKey(MushAttributeName, related_name='characters', null=True, on_delete=models.SET_NULL)
     value = models.TextField(blank=True)
 
     class Meta:
         unique_together = (("dbref", "attr"),)
 
 
+class MushAttributeCache(object):
+    """
+    Case-folded attribute values for the MushObjects that opted in with cache_attributes(), keyed by object id.
+    Saving or deleting a MushAttribute marks its object stale and the next lookup reloads it. Bulk writes do not
+    send signals, so callers doing those must invalidate() themselves.
+    """
+
+    def __init__(self):
+        self.values = dict()
+
+    def load(self, obj_id):
+        found = self.values[obj_id] = {key.upper(): value for key, value in
+                                       MushAttribute.objects.filter(dbref_id=obj_id).values_list('attr__key', 'value')}
+        return found
+
+    def enable(self, obj_id):
+        return self.load(obj_id)
+
+    def disable(self, obj_id):
+        self.values.pop(obj_id, None)
+
+    def get(self, obj_id):
+        if obj_id not in self.values:
+            return None
+        if (found := self.values[obj_id]) is None:
+            found = self.load(obj_id)
+        return found
+
+    def invalidate(self, obj_id):
+        if obj_id in self.values:
+            self.values[obj_id] = None
+
+    def clear(self):
+        self.values.clear()
+
+
+attribute_cache = MushAttributeCache()
+
+
+class MushStats(object):
+    """
+    A parsed name~value|name~value attribute. index maps every lower-cased prefix of a stat name to the stat that
+    partial_match would pick for it: the shortest name starting with it, so an exact match always wins.
+    """
+    __slots__ = ('value', 'stats', 'index')
+
+    def __init__(self, value):
+        self.value = value
+        self.stats = dict()
+        for element in value.split('|'):
+            name, stat = element.split('~', 1)
+            self.stats[name] = stat
+        self.index = dict()
+        for name in sorted(self.stats, key=len):
+            lower = name.lower()
+            for end in range(len(lower) + 1):
+                self.index.setdefault(lower[:end], name)
+
+    def find(self, stat):
+        if (name := self.index.get(stat.lower())) is None:
+            return None
+        return self.stats[name]
+
+
+class MushStatCache(object):
+    """
+    MushStats keyed by attribute name and value hash, so each stat blob is split once and shared by every lookup and
+    every object holding the same value. Entries are checked against the full value, so a changed attribute simply
+    misses. The least recently used entries are dropped past maxsize.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, attrname, value):
+        key = (attrname.upper(), hash(value))
+        found = self.entries.get(key)
+        if found is not None and found.value == value:
+            self.entries.move_to_end(key)
+            return found
+        found = self.entries[key] = MushStats(value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return found
+
+    def clear(self):
+        self.entries.clear()
+
+
+stat_cache = MushStatCache()
+
+
+@receiver(post_save, sender=MushAttribute)
+@receiver(post_delete, sender=MushAttribute)
+def invalidate_attribute_cache(sender, instance, **kwargs):
+    attribute_cache.invalidate(instance.dbref_id)
+    if instance.dbref_id == object_resolver.ccp_id:
+        object_resolver.cobjs = None
+
+
+class MushImportJournal(models.Model):
+    stage = models.CharField(max_length=50, unique=True)
+    position = models.CharField(max_length=255, null=True)
+    count = models.PositiveIntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+
+
+class MushImportRecord(models.Model):
+    stage = models.CharField(max_length=50, db_index=True)
+    source = models.CharField(max_length=255)
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = (("stage", "source"),)
+
+
 class ThemeBridge(SharedMemoryModel):
     db_script = models.OneToOneField('scripts.ScriptDB', related_name='theme_bridge', primary_key=True,
                                      on_delete=models.CASCADE)
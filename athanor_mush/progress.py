@@ -0,0 +1,82 @@
+import time
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}"
+
+
+class ImportProgress(object):
+    """
+    Aggregates row counts for one import stage and reports them at most once per interval, or whenever another
+    percent_step percent of the total is done. Each report shows throughput, elapsed time and, when the total is
+    known, an ETA.
+
+    Per-row messages go through detail() and are only shown in verbose mode. note() sets a line that is appended to
+    the next reports instead, for per-batch figures that should be seen without flooding the output.
+    """
+
+    def __init__(self, stage, total=None, callback=None, verbose=False, interval=5.0, percent_step=10):
+        if callback:
+            self.message_callback = callback
+        else:
+            self.message_callback = print
+        self.stage = stage
+        self.total = total
+        self.verbose = verbose
+        self.interval = interval
+        self.percent_step = percent_step
+        self.count = 0
+        self.initial = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.last_percent = 0
+        self.last_note = None
+
+    def resume(self, count):
+        self.count = self.initial = count
+
+    def detail(self, message):
+        if self.verbose:
+            self.message_callback(message)
+
+    def note(self, message):
+        self.last_note = message
+
+    def update(self, count=1):
+        self.count += count
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.report(now)
+        elif self.total and self.percent_step:
+            if (self.count * 100 // self.total) >= self.last_percent + self.percent_step:
+                self.report(now)
+
+    def status(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self.started
+        rate = (self.count - self.initial) / elapsed if elapsed > 0 else 0.0
+        if self.total:
+            percent = self.count * 100 // self.total
+            message = f"{self.stage}: {self.count} of {self.total} ({percent}%) - {rate:.1f} rows/s - elapsed {format_duration(elapsed)}"
+            if rate > 0:
+                message += f" - ETA {format_duration((self.total - self.count) / rate)}"
+        else:
+            message = f"{self.stage}: {self.count} - {rate:.1f} rows/s - elapsed {format_duration(elapsed)}"
+        if self.last_note:
+            message += f" - {self.last_note}"
+        return message
+
+    def report(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.last_report = now
+        if self.total:
+            self.last_percent = self.count * 100 // self.total
+        self.message_callback(self.status(now))
+
+    def finish(self):
+        self.message_callback(f"Finished {self.status()}")
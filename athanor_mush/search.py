@@ -0,0 +1,105 @@
+from django.db import connection, OperationalError
+
+from . models import MushAttribute
+
+
+class AttributeSearch(object):
+    """
+    Full-text index over MushAttribute values, used by @penn/grep.
+
+    On SQLite this is an external-content FTS5 table kept current by triggers. On PostgreSQL it is a GIN index on
+    to_tsvector('simple', value). Other backends, or a SQLite built without FTS5, fall back to an icontains scan.
+    build() is run at the end of @penn/initialize and may be re-run at any time to rebuild the index.
+    """
+    fts_table = 'athanor_mush_attrsearch'
+    pg_index = 'athanor_mush_attrsearch_gin'
+
+    def __init__(self, using=connection):
+        self.connection = using
+        self.attr_table = MushAttribute._meta.db_table
+
+    @property
+    def vendor(self):
+        return self.connection.vendor
+
+    def sqlite_statements(self):
+        table, fts = self.attr_table, self.fts_table
+        return [
+            f"DROP TABLE IF EXISTS {fts}",
+            f"CREATE VIRTUAL TABLE {fts} USING fts5(value, content='{table}', content_rowid='id')",
+            f"INSERT INTO {fts}({fts}) VALUES('rebuild')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, value) VALUES (new.id, new.value); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, value) VALUES('delete', old.id, old.value); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, value) VALUES('delete', old.id, old.value); "
+            f"INSERT INTO {fts}(rowid, value) VALUES (new.id, new.value); END",
+        ]
+
+    def postgresql_statements(self):
+        return [f"CREATE INDEX IF NOT EXISTS {self.pg_index} ON {self.attr_table} "
+                f"USING GIN (to_tsvector('simple', value))"]
+
+    def build(self):
+        """
+        Create or rebuild the index. Returns False if this backend has no full-text support.
+        """
+        statements = getattr(self, f"{self.vendor}_statements", None)
+        if not statements:
+            return False
+        with self.connection.cursor() as cursor:
+            try:
+                for statement in statements():
+                    cursor.execute(statement)
+            except OperationalError:
+                # Most likely an SQLite built without FTS5.
+                if self.vendor != 'sqlite':
+                    raise
+                return False
+        return True
+
+    def available(self):
+        if self.vendor == 'postgresql':
+            return True
+        if self.vendor != 'sqlite':
+            return False
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s", [self.fts_table])
+            return cursor.fetchone() is not None
+
+    def search(self, pattern, limit=50):
+        """
+        Find attributes whose value contains the words of pattern, as a phrase. Returns a list of
+        (objid, object name, attribute name, snippet) tuples.
+        """
+        if not self.available():
+            return self.scan(pattern, limit)
+        if self.vendor == 'sqlite':
+            query = (f"SELECT a.id, snippet({self.fts_table}, 0, '[', ']', '...', 12) FROM {self.fts_table} "
+                     f"INNER JOIN {self.attr_table} a ON a.id = {self.fts_table}.rowid "
+                     f"WHERE {self.fts_table} MATCH %s ORDER BY rank LIMIT %s")
+            params = ['"%s"' % pattern.replace('"', '""'), limit]
+        else:
+            query = (f"SELECT id, ts_headline('simple', value, phraseto_tsquery('simple', %s), "
+                     f"'StartSel=[, StopSel=], MaxFragments=1, MaxWords=24, MinWords=8') FROM {self.attr_table} "
+                     f"WHERE to_tsvector('simple', value) @@ phraseto_tsquery('simple', %s) LIMIT %s")
+            params = [pattern, pattern, limit]
+        with self.connection.cursor() as cursor:
+            cursor.execute(query, params)
+            snippets = dict(cursor.fetchall())
+        return self.results(snippets)
+
+    def scan(self, pattern, limit=50):
+        snippets = dict()
+        for attr_id, value in MushAttribute.objects.filter(value__icontains=pattern).values_list('id', 'value')[:limit]:
+            start = value.lower().find(pattern.lower())
+            end = start + len(pattern)
+            snippets[attr_id] = f"{value[max(start - 40, 0):start]}[{value[start:end]}]{value[end:end + 40]}"
+        return self.results(snippets)
+
+    def results(self, snippets):
+        rows = MushAttribute.objects.filter(id__in=list(snippets)).values_list('id', 'dbref__objid', 'dbref__name',
+                                                                                'attr__key')
+        found = {attr_id: (objid, name, key, snippets[attr_id]) for attr_id, objid, name, key in rows}
+        return [found[attr_id] for attr_id in snippets if attr_id in found]
@@ -0,0 +1,166 @@
+import gzip, os, shutil, tempfile
+from unittest import TestCase
+
+from . convpenn import PennParser, PennScanner, penn_color, process_penntext
+from . wildcard import compile_wildcard, prefix_filter
+
+
+class TestProcessPenntext(TestCase):
+
+    def test_markup(self):
+        cases = [
+            ('', ''),
+            ('plain text', 'plain text'),
+            ('line%rbreak%Rtab%tend%T', 'line\nbreak\ntab\tend\t'),
+            ('100% sure', '100% sure'),
+            ('\002pa xch_cmd="look"\003Look\002p/a\003', '|lclook|ltLook|le'),
+            ('\002psend "+who"\003who\002p/send\003', '|lc+who|ltwho|le'),
+            ('\002pb\003bold\002p/b\003', 'bold'),
+            ('\002pa xch_cmd="n"\003\002pb\003North\002p/b\003\002p/a\003', '|lcn|ltNorth|le'),
+            ('\002pa xch_cmd="n"\003unclosed', 'unclosed'),
+            ('\002p/a\003stray close', 'stray close'),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(process_penntext(text), expected)
+
+
+
+
+def outdb_object(dbref):
+    return (f'!{dbref}\nname "Object {dbref}"\nlocation #0\ncontents #-1\nexits #-1\nnext #-1\nparent #{dbref // 2}\n'
+            f'lockcount 0\nowner #1\nzone #-1\npennies 0\ntype {dbref % 4 + 1}\nflags "WIZARD SAFE"\npowers ""\n'
+            f'warnings 0\ncreated 1500000000\nmodified 1500000000\nattrcount 4\n'
+            f' name "DESCRIBE"\n  owner #1\n  flags ""\n  derefs 0\n'
+            f'  value "Room {dbref}%r\002chr\003red\002c/\003%t\002pa xch_cmd=\\"look\\"\003look\002p/a\003"\n'
+            f' name "ALIAS"\n  owner #1\n  flags ""\n  derefs 0\n  value "o{dbref}"\n'
+            f' name "V`STATS"\n  owner #1\n  flags ""\n  derefs 0\n  value "Str~{dbref}|Dex~\002cg\0034\002c/\003"\n'
+            f' name "MULTI"\n  owner #1\n  flags ""\n  derefs 0\n  value "first {dbref}\nsecond"\n')
+
+
+class TestPennParser(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.outdb = os.path.join(cls.directory, 'outdb')
+        with open(cls.outdb, 'w', encoding='iso-8859-1') as outdb:
+            outdb.write('+V74247\n~25\ndbflags\nsavedtime "x"\nflags\n')
+            outdb.write(''.join(outdb_object(dbref) for dbref in range(25)))
+            outdb.write('***END OF DUMP***\n')
+        cls.compressed = f"{cls.outdb}.gz"
+        with open(cls.outdb, 'rb') as source, gzip.open(cls.compressed, 'wb') as target:
+            shutil.copyfileobj(source, target)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    @staticmethod
+    def records(penn_objects):
+        return [(penn_object.dbref, penn_object.name, penn_object.type, penn_object.location, penn_object.exits,
+                 penn_object.parent, penn_object.owner, penn_object.created, penn_object.flags, penn_object.powers,
+                 dict(penn_object.attributes)) for penn_object in penn_objects]
+
+    def parse(self, file, workers=1):
+        parser = PennParser(callback=lambda message: None, workers=workers, chunk_size=4)
+        return self.records(parser.iter_objects(file))
+
+    def test_paths_agree(self):
+        serial = self.parse(self.outdb)
+        self.assertEqual(len(serial), 25)
+        self.assertEqual(serial[3][10]['V`STATS'], 'Str~3|Dex~4')
+        for file in (self.outdb, self.compressed):
+            with self.subTest(file=file):
+                self.assertEqual(self.parse(file), serial)
+                self.assertEqual(self.parse(file, workers=2), serial)
+                with PennScanner(file, callback=lambda message: None) as scanner:
+                    self.assertEqual(self.records(scanner), serial)
+
+
+class TestPennColor(TestCase):
+
+    def test_color_spans(self):
+        cases = [
+            ('\002chr\003red\002c/\003 plain', '|rred|n plain'),
+            ('\002cr\003dark\002c/\003', '|Rdark|n'),
+            ('\002c#ff0000\003hex\002c/\003', '|500hex|n'),
+            ('\002ch\003\002cr\003A\002c/\003B\002c/\003', '|h|rA|n|hB|n'),
+            ('\002cr\003\002cn\003A\002c/\003B\002c/\003', '|R|nA|n|RB|n'),
+            ('\002chr\003unclosed', '|runclosed|n'),
+            ('\002pa xch_cmd="n"\003\002chr\003X\002p/a\003after', '|lcn|lt|rX|le|nafter'),
+            ('\002chr\003R\002pa xch_cmd="n"\003\002chb\003X\002p/a\003after\002c/\003',
+             '|rR|lcn|lt|bX|le|n|rafter|n'),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(process_penntext(text), expected)
+
+    def test_without_markup(self):
+        cases = [
+            ('Str~3|Dex~\002chr\0035\002c/\003', 'Str~3|Dex~5'),
+            ('\002ch\003\002cr\003A\002c/\003B\002c/\003', 'AB'),
+            ('\002pa xch_cmd="look"\003\002chr\003Look\002c/\003\002p/a\003', 'Look'),
+            ('\002pa xch_cmd="n"\003\002chr\003X\002p/a\003after', 'Xafter'),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(process_penntext(text, markup=False), expected)
+
+    def test_color_specs(self):
+        cases = [
+            ('r', '|R'),
+            ('hr', '|r'),
+            ('hr!B', '|r|[B'),
+            ('u', '|u'),
+            ('<255 0 0>', '|500'),
+            ('+blue', '|005'),
+            ('<240>', '|=j'),
+            ('zz', ''),
+        ]
+        for spec, expected in cases:
+            with self.subTest(spec=spec):
+                self.assertEqual(penn_color(spec), expected)
+
+
+class TestWildcard(TestCase):
+
+    def test_matching(self):
+        cases = [
+            ('D`*', 'D`STR', True),
+            ('D`*', 'D`', True),
+            ('D`*', 'D`STR`BONUS', False),
+            ('D`**', 'D`STR`BONUS', True),
+            ('d`*', 'D`STR', True),
+            ('FIN?L', 'FINAL', True),
+            ('FIN?L', 'FINL', False),
+            ('?', '`', True),
+            ('*', 'A`B', False),
+            ('**', 'A`B', True),
+            ('A\\*', 'A*', True),
+            ('A\\*', 'AB', False),
+            ('A.B', 'AXB', False),
+            ('DESC', 'DESC', True),
+            ('DESC', 'DESCRIBE', False),
+        ]
+        for pattern, key, expected in cases:
+            with self.subTest(pattern=pattern, key=key):
+                prefix, regex = compile_wildcard(pattern)
+                self.assertEqual(bool(regex.fullmatch(key)), expected)
+
+    def test_prefix(self):
+        cases = [
+            ('D`*', 'D`'),
+            ('d`**', 'D`'),
+            ('*', ''),
+            ('FIN?L', 'FIN'),
+            ('A\\*B*', 'A*B'),
+            ('DESC', 'DESC'),
+        ]
+        for pattern, expected in cases:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(compile_wildcard(pattern)[0], expected)
+
+    def test_prefix_filter(self):
+        self.assertEqual(prefix_filter('attr__key', ''), dict())
+        self.assertEqual(prefix_filter('attr__key', 'D`'), {'attr__key__startswith': 'D`'})
@@ -0,0 +1,59 @@
+import re
+from functools import lru_cache
+
+
+@lru_cache(maxsize=512)
+def compile_wildcard(pattern):
+    """
+    Compile a Penn attribute wildcard into a (prefix, regex) pair.
+
+    As in Penn, * matches any run of characters except the ` that separates attribute tree levels, ** matches
+    across levels, ? matches any single character and a backslash makes the next character literal. Matching is
+    case-insensitive. prefix is the literal text before the first wildcard, upper-cased like stored attribute names,
+    so callers can narrow a search down to an index range before applying the regex.
+    """
+    pattern = pattern.upper()
+    parts = list()
+    literal = list()
+    prefix = None
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\' and index + 1 < len(pattern):
+            index += 1
+            literal.append(pattern[index])
+            parts.append(re.escape(pattern[index]))
+        elif char in '*?':
+            if prefix is None:
+                prefix = ''.join(literal)
+            if char == '?':
+                parts.append('.')
+            elif pattern[index + 1:index + 2] == '*':
+                index += 1
+                parts.append('.*')
+            else:
+                parts.append('[^`]*')
+        else:
+            literal.append(char)
+            parts.append(re.escape(char))
+        index += 1
+    if prefix is None:
+        prefix = ''.join(literal)
+    return prefix, re.compile(''.join(parts), re.IGNORECASE | re.DOTALL)
+
+
+def prefix_filter(field, prefix):
+    """
+    Filter kwargs limiting field to values starting with prefix. A startswith lookup is used instead of a >= / <
+    range because a computed upper bound only sorts correctly under binary collations; MySQL's case-insensitive
+    collations put 'Da' before 'D`'. Under a case-insensitive collation this can also match other cases, so callers
+    still check keys in Python.
+    """
+    if not prefix:
+        return dict()
+    return {f"{field}__startswith": prefix}
+
+
+def wildcard_filter(keys, pattern):
+    prefix, regex = compile_wildcard(pattern)
+    return [key for key in keys if regex.fullmatch(key)]